@@ -12,6 +12,7 @@ with st.form("crpc_form"):
     officer_name = st.text_input("Officer Name")
     designation = st.text_input("Designation")
     police_station = st.text_input("Police Station")
+    station_key = st.text_input("Station Key (leave blank for default)")
     contact_info = st.text_input("Contact Info (email / phone)")
     case_number = st.text_input("Case Number / FIR Number")
     recipient = st.text_input("Nodal Officer / Organization")
@@ -37,6 +38,7 @@ if submitted:
             "date_range": date_range,
             "data_requested": data_requested,
             "case_purpose": case_purpose,
+            "station": station_key or None,
         }
 
         try:
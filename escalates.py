@@ -1,11 +1,13 @@
 from fastapi import FastAPI, HTTPException
+from typing import Optional
 from jinja2 import Template
 from datetime import datetime, timedelta
 from weasyprint import HTML
-import os, uuid, smtplib
-from email.message import EmailMessage
+import os, uuid
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from mailer import body_template, send_email, smtp_session
+from stations import ensure_station_indexes, worker_stations
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +17,7 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 client = MongoClient(MONGO_URI)
 db = client["social_monitoring"]
 collection = db["flagged_messages"]
+ensure_station_indexes(collection)
 
 # Email credentials
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
@@ -52,75 +55,74 @@ TEMPLATE_HTML = """
 </body>
 </html>
 """
+ESCALATION_TEMPLATE = Template(TEMPLATE_HTML)
+
+ESCALATION_SUBJECT = "⚠ CrPC Escalation - No Response Received"
+ESCALATION_BODY = body_template(
+    "Dear {{ username }},\n\nNo reply was received within 72 hours. Attached is a CrPC 91 escalation notice.\n\nCyber Monitoring Unit"
+)
 
 app = FastAPI()
 
 @app.post("/escalate")
-def escalate_cases():
-    try:
-        cutoff = datetime.utcnow() - timedelta(hours=72)
-        to_escalate = collection.find({
-            "status": "warning_sent",
-            "responded": {"$ne": True},
-            "warning_sent_at": {"$lte": cutoff}
-        })
-
-        count = 0
-        for user in to_escalate:
-            email = user.get("email")
-            username = user.get("username", "User")
-            text = user.get("text", "")
-
-            if not email:
+def escalate_cases(station: Optional[str] = None):
+    count, failed = {}, {}
+    # Each station is scanned with its own partition key and mailbox; one failing station
+    # (missing password, login refused) is reported without stopping the others
+    for st in worker_stations(db, station):
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=72)
+            to_escalate = list(collection.find({
+                "station": st.key,
+                "status": "warning_sent",
+                "responded": {"$ne": True},
+                "warning_sent_at": {"$lte": cutoff}
+            }))
+            if not to_escalate:
                 continue
 
-            html = Template(TEMPLATE_HTML).render(
-                recipient=email,
-                username=username,
-                email=email,
-                text=text,
-                generated_on=datetime.now().strftime("%d-%m-%Y %H:%M")
-            )
-
-            os.makedirs("outputs", exist_ok=True)
-            filename = f"crpc_escalation_{uuid.uuid4().hex}.pdf"
-            filepath = os.path.join("outputs", filename)
-            HTML(string=html).write_pdf(filepath)
-
-            send_email(
-                to_address=email,
-                subject="⚠ CrPC Escalation - No Response Received",
-                body=f"Dear {username},\n\nNo reply was received within 72 hours. Attached is a CrPC 91 escalation notice.\n\nCyber Monitoring Unit",
-                attachment_path=filepath
-            )
-
-            collection.update_one({"_id": user["_id"]}, {"$set": {
-                "status": "escalated",
-                "escalated_at": datetime.utcnow(),
-                "escalation_pdf": filename
-            }})
-            count += 1
-
-        return {"message": f"🔺 Total users escalated: {count}"}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-def send_email(to_address, subject, body, attachment_path):
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = EMAIL_ADDRESS
-    msg["To"] = to_address
-    msg.set_content(body)
-
-    with open(attachment_path, "rb") as f:
-        msg.add_attachment(
-            f.read(),
-            maintype="application",
-            subtype="pdf",
-            filename=os.path.basename(attachment_path)
-        )
-
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        smtp.send_message(msg)
\ No newline at end of file
+            with smtp_session(st["sender_email"], st.sender_password) as smtp:
+                for user in to_escalate:
+                    email = user.get("email")
+                    username = user.get("username", "User")
+                    text = user.get("text", "")
+
+                    if not email:
+                        continue
+
+                    html = ESCALATION_TEMPLATE.render(
+                        recipient=email,
+                        username=username,
+                        email=email,
+                        text=text,
+                        generated_on=datetime.now().strftime("%d-%m-%Y %H:%M")
+                    )
+
+                    os.makedirs("outputs", exist_ok=True)
+                    filename = f"crpc_escalation_{uuid.uuid4().hex}.pdf"
+                    filepath = os.path.join("outputs", filename)
+                    HTML(string=html).write_pdf(filepath)
+
+                    send_email(
+                        to_address=email,
+                        subject=ESCALATION_SUBJECT,
+                        body=ESCALATION_BODY.render(username=username),
+                        attachment_path=filepath,
+                        smtp=smtp,
+                        sender=st["sender_email"]
+                    )
+
+                    collection.update_one({"_id": user["_id"]}, {"$set": {
+                        "status": "escalated",
+                        "escalated_at": datetime.utcnow(),
+                        "escalation_pdf": filename
+                    }})
+                    count[st.key] = count.get(st.key, 0) + 1
+
+        except Exception as e:
+            print(f"❌ [{st.key}] {e}")
+            failed[st.key] = str(e)
+
+    if failed and not count:
+        raise HTTPException(status_code=500, detail=failed)
+    return {"message": f"🔺 Total users escalated: {sum(count.values())}", "stations": count, "failed": failed}
@@ -0,0 +1,273 @@
+# export.py (incremental Parquet snapshots + precomputed rollups for analysts)
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from pymongo import ASCENDING, MongoClient, ReadPreference
+from rules import RuleStore
+
+# Load environment variables
+load_dotenv()
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "crpcdb")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+# Incremental runs look back this far past the last run, for writers whose clocks lag ours
+EXPORT_MARGIN = timedelta(minutes=5)
+
+# ---------------------------- SCHEMAS ----------------------------
+
+TS = pa.timestamp("us")
+
+# collection -> (day field, lifecycle fields, arrow schema). A document is re-exported (with its
+# whole day partition) whenever any lifecycle field moves past the last run.
+EXPORTS = {
+    "flagged_messages": ("flagged_at", ("flagged_at", "warning_sent_at", "followup_sent_at",
+                                        "responded_at", "escalated_at"), pa.schema([
+        ("id", pa.string()),
+        ("station", pa.string()),
+        ("username", pa.string()),
+        ("email", pa.string()),
+        ("text", pa.string()),
+        ("suspicion_score", pa.float64()),
+        ("matched_keywords", pa.list_(pa.string())),
+        ("rule_version", pa.string()),
+        ("status", pa.string()),
+        ("responded", pa.bool_()),
+        ("flagged_at", TS),
+        ("warning_sent_at", TS),
+        ("responded_at", TS),
+        ("escalated_at", TS),
+    ])),
+    "crpc_requests": ("sent_at", ("sent_at",), pa.schema([
+        ("id", pa.string()),
+        ("station", pa.string()),
+        ("case_number", pa.string()),
+        ("user", pa.string()),
+        ("email", pa.string()),
+        ("recipient", pa.string()),
+        ("status", pa.string()),
+        ("pdf", pa.string()),
+        ("sent_at", TS),
+    ])),
+}
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None) if value.tzinfo else value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+
+def _row(doc, schema, matcher):
+    row = {}
+    for field in schema:
+        if field.name == "id":
+            row["id"] = str(doc["_id"])
+        elif field.name == "matched_keywords":
+            keywords = doc.get("matched_keywords")
+            if keywords is None:
+                # Flagged before matches were stored: re-derive with the active rules
+                keywords = matcher.scan(str(doc.get("text", ""))).matched
+            row["matched_keywords"] = list(keywords)
+        elif field.name == "pdf":
+            row["pdf"] = doc.get("pdf") or doc.get("filename")
+        elif field.type == TS:
+            row[field.name] = _timestamp(doc.get(field.name))
+        elif field.type == pa.bool_():
+            row[field.name] = bool(doc.get(field.name, False))
+        elif field.type == pa.float64():
+            # Rule weights can be fractional, so scores are not always integers
+            value = doc.get(field.name)
+            row[field.name] = float(value) if value not in (None, "") else None
+        else:
+            value = doc.get(field.name)
+            row[field.name] = str(value) if value is not None else None
+    return row
+
+# ---------------------------- SNAPSHOTS ----------------------------
+
+def _state_path():
+    return os.path.join(SNAPSHOT_DIR, "_state.json")
+
+
+def _load_state():
+    if os.path.exists(_state_path()):
+        with open(_state_path()) as f:
+            return json.load(f)
+    return {}
+
+
+def _write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _day(value):
+    return datetime(value.year, value.month, value.day)
+
+
+def _all_days(since, until):
+    day = _day(since)
+    while day <= until:
+        yield day
+        day += timedelta(days=1)
+
+
+def changed_days(collection, name, since):
+    """Day partitions holding a document whose lifecycle moved on since `since`.
+
+    A warning, reply or escalation can land any time after flagging, so selecting on the
+    lifecycle timestamps (not on the day field alone) keeps old partitions current.
+    """
+    day_field, lifecycle, _ = EXPORTS[name]
+    docs = collection.find({"$or": [{field: {"$gte": since}} for field in lifecycle]}, {day_field: 1})
+    return sorted({_day(ts) for ts in (_timestamp(doc.get(day_field)) for doc in docs) if ts})
+
+
+def export_collection(collection, name, days, matcher):
+    """Rewrite the Parquet file of each UTC day in `days` for `collection`."""
+    day_field, _, schema = EXPORTS[name]
+    written = 0
+    for day in days:
+        next_day = day + timedelta(days=1)
+        docs = collection.find({day_field: {"$gte": day, "$lt": next_day}})
+        table = pa.Table.from_pylist([_row(doc, schema, matcher) for doc in docs], schema=schema)
+        path = os.path.join(SNAPSHOT_DIR, name, f"day={day:%Y-%m-%d}", "part-0.parquet")
+        if table.num_rows:
+            _write_atomic(path, lambda tmp: pq.write_table(table, tmp, compression="zstd"))
+            written += table.num_rows
+        elif os.path.exists(path):
+            os.remove(path)
+    return written
+
+
+def run_export(db, now=None):
+    """Export every day touched since the last run (all days on the first), then rebuild rollups."""
+    now = now or datetime.utcnow()
+    state = _load_state()
+    matcher = RuleStore(db).current()
+    counts = {}
+    for name, (day_field, lifecycle, _) in EXPORTS.items():
+        # Analytics reads go to a secondary when there is one
+        collection = db[name].with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        for field in lifecycle:
+            db[name].create_index([(field, ASCENDING)])
+        if name in state:
+            days = changed_days(collection, name, datetime.fromisoformat(state[name]) - EXPORT_MARGIN)
+        else:
+            first = collection.find_one({day_field: {"$type": "date"}}, sort=[(day_field, ASCENDING)])
+            days = list(_all_days(_timestamp(first[day_field]), now)) if first else []
+        counts[name] = export_collection(collection, name, days, matcher)
+        state[name] = now.isoformat()
+
+    rollups = build_rollups(matcher.categories)
+    _write_atomic(os.path.join(SNAPSHOT_DIR, "rollups.json"),
+                  lambda tmp: _dump_json(rollups, tmp))
+    _write_atomic(_state_path(), lambda tmp: _dump_json(state, tmp))
+    return counts
+
+# ---------------------------- ROLLUPS ----------------------------
+
+def _dump_json(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f, default=str, indent=2)
+
+
+def _read_snapshot(name):
+    path = os.path.join(SNAPSHOT_DIR, name)
+    schema = EXPORTS[name][2].append(pa.field("day", pa.string()))
+    if not os.path.isdir(path):
+        return pa.Table.from_pylist([], schema=schema)
+    # The explicit schema casts partitions written by older exports (e.g. int32 scores)
+    partitioning = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+    return ds.dataset(path, schema=schema, format="parquet", partitioning=partitioning).to_table()
+
+
+def _records(table, sort_keys):
+    return table.sort_by([(k, "ascending") for k in sort_keys]).to_pylist()
+
+
+def build_rollups(categories):
+    """Rollups computed from the Parquet snapshots only; never touches the live cluster.
+
+    `categories` maps rule id -> category (Matcher.categories).
+    """
+    flags = _read_snapshot("flagged_messages").combine_chunks()
+    day = pc.strftime(flags["flagged_at"], format="%Y-%m-%d")
+
+    # Flags per keyword/category per day. matched_keywords has one entry per hit, so a message
+    # that says "crypto" four times is still one flag: count distinct flag ids.
+    parents = pc.list_parent_indices(flags["matched_keywords"])
+    keywords = pc.list_flatten(flags["matched_keywords"])
+    categories = pa.array([categories.get(k, "other") for k in keywords.to_pylist()], pa.string())
+    hits = pa.table({
+        "id": pc.take(flags["id"], parents),
+        "day": pc.take(day, parents),
+        "station": pc.take(flags["station"], parents),
+        "keyword": keywords,
+        "category": categories,
+    })
+    per_keyword = hits.group_by(["day", "station", "keyword", "category"]).aggregate([("id", "count_distinct")])
+    per_keyword = per_keyword.rename_columns(["day", "station", "keyword", "category", "flags"])
+
+    # Warning -> reply conversion per day the warning went out
+    warned = flags.filter(pc.is_valid(flags["warning_sent_at"]))
+    conversion = pa.table({
+        "day": pc.strftime(warned["warning_sent_at"], format="%Y-%m-%d"),
+        "station": warned["station"],
+        "replied": pc.cast(pc.is_valid(warned["responded_at"]), pa.int64()),
+        "escalated": pc.cast(pc.is_valid(warned["escalated_at"]), pa.int64()),
+    }).group_by(["day", "station"]).aggregate([
+        ([], "count_all"), ("replied", "sum"), ("escalated", "sum"),
+    ]).rename_columns(["day", "station", "warnings_sent", "replied", "escalated"])
+    conversion_rows = _records(conversion, ["day", "station"])
+    for row in conversion_rows:
+        row["reply_rate"] = round(row["replied"] / row["warnings_sent"], 4) if row["warnings_sent"] else None
+
+    # Escalation latency (warning sent -> escalated), hours
+    escalated = warned.filter(pc.is_valid(warned["escalated_at"]))
+    hours = pc.divide(pc.cast(pc.subtract(escalated["escalated_at"], escalated["warning_sent_at"]), pa.int64()),
+                      3600 * 1e6)
+    latency = pa.table({"station": escalated["station"], "hours": hours}).group_by("station").aggregate([
+        ([], "count_all"), ("hours", "mean"), ("hours", "tdigest", pc.TDigestOptions(q=[0.5, 0.9])),
+    ]).rename_columns(["station", "escalations", "mean_hours", "quantiles"])
+    latency_rows = []
+    for row in _records(latency, ["station"]):
+        p50, p90 = row.pop("quantiles") or (None, None)
+        latency_rows.append({**row, "p50_hours": p50, "p90_hours": p90})
+
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "flags_per_keyword_day": _records(per_keyword, ["day", "station", "keyword"]),
+        "warning_conversion": conversion_rows,
+        "escalation_latency": latency_rows,
+    }
+
+
+def load_rollups():
+    path = os.path.join(SNAPSHOT_DIR, "rollups.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    client = MongoClient(MONGO_URI)
+    exported = run_export(client[MONGO_DB])
+    for name, rows in exported.items():
+        print(f"📦 Exported {rows} rows from {name}")
@@ -1,7 +1,11 @@
 from datetime import datetime, timezone
-import re
 from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 import os
+from membership import MembershipCache
+from rules import RuleStore
+from stations import DEFAULT_STATION, WORKER_STATIONS, ensure_station_indexes, load_stations
 
 # Load .env
 load_dotenv()
@@ -12,35 +16,54 @@ client = MongoClient(MONGO_URI)
 db = client["social_monitoring"]
 source_collection = db["messages_telegram"]
 flagged_collection = db["flagged_messages"]
+ensure_station_indexes(flagged_collection)
 
-# Define suspicious keywords
-SUSPICIOUS_KEYWORDS = [
-    "betting", "crypto", "money laundering", "nude", "drug", "blackmail",
-    "dark web", "bitcoin", "casino", "win money", "10x returns", "double your money"
-]
+# Already-flagged ids/emails, so new messages skip the per-hit duplicate lookup
+membership = MembershipCache(flagged_collection).build()
 
-# Compile regex for performance
-pattern = re.compile(r"|".join([re.escape(word) for word in SUSPICIOUS_KEYWORDS]), re.IGNORECASE)
+# Keyword rules come from the rule store (rules.py); one matcher per run
+matcher = RuleStore(db).current()
 
 # Threshold to consider someone suspicious (e.g., must match 2+ keywords)
 SUSPICION_THRESHOLD = 1
 
 flagged_count = 0
 
+# Flags are only useful for stations that exist; the rest wait until the station is registered
+known_stations = set(load_stations(db))
+unknown_stations = {}
+
+# Pinned workers only scan their own stations' messages
+source_query = {"station": {"$in": WORKER_STATIONS}} if WORKER_STATIONS else {}
+
 # Process messages
-for msg in source_collection.find():
+for msg in source_collection.find(source_query):
     text = str(msg.get("text", ""))
-    suspicion_matches = pattern.findall(text)
-    suspicion_count = len(suspicion_matches)
+    scan = matcher.scan(text)
 
-    if suspicion_count >= SUSPICION_THRESHOLD:
-        msg["suspicion_score"] = suspicion_count
+    if scan.score >= SUSPICION_THRESHOLD:
+        msg["station"] = msg.get("station") or DEFAULT_STATION
+        if msg["station"] not in known_stations:
+            unknown_stations[msg["station"]] = unknown_stations.get(msg["station"], 0) + 1
+            continue
+        msg.update(scan.as_fields())
         msg["flagged_at"] = datetime.now(timezone.utc)
         msg["status"] = "warning_pending"
 
-        # Prevent duplicate insert by checking _id
-        if not flagged_collection.find_one({"_id": msg["_id"]}):
+        # Prevent duplicate insert; only ids the filter may have seen need a DB check
+        if membership.flag_ids.might_contain(msg["_id"]):
+            if flagged_collection.find_one({"_id": msg["_id"]}, {"_id": 1}):
+                continue
+            membership.flag_ids.record_false_positive()
+        try:
             flagged_collection.insert_one(msg)
-            flagged_count += 1
+        except DuplicateKeyError:
+            continue
+        if membership.record(msg):
+            membership.build()
+        flagged_count += 1
 
-print(f"✅ Flagged {flagged_count} suspicious messages.")
\ No newline at end of file
+print(f"✅ Flagged {flagged_count} suspicious messages (rule version {matcher.version}).")
+if unknown_stations:
+    print(f"⚠ Skipped messages for unregistered stations: {unknown_stations}")
+print(f"📊 Membership cache: {membership.stats()['flag_ids']}")
\ No newline at end of file
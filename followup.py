@@ -4,8 +4,8 @@ from pymongo import MongoClient
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
-import smtplib
-from email.message import EmailMessage
+from mailer import body_template, build_message, send_message, smtp_session
+from stations import ensure_station_indexes, worker_stations
 
 # Load env vars
 load_dotenv()
@@ -17,25 +17,13 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 client = MongoClient(MONGO_URI)
 db = client["crpc_db"]
 collection = db["requests"]
+ensure_station_indexes(crpc_collection=collection)
 
-# 48 hours ago
-cutoff = datetime.utcnow() - timedelta(hours=1)
+# Email template (compiled once, rendered per case)
+FOLLOWUP_BODY = body_template("""
+Dear {{ recipient }},
 
-# Query for sent cases older than 48h and not yet followed up
-pending = collection.find({
-    "status": "sent",
-    "sent_at": {"$lt": cutoff}
-})
-
-for case in pending:
-    msg = EmailMessage()
-    msg["Subject"] = f"⚠ Follow-Up: CrPC 91 Request – Case {case['case_number']}"
-    msg["From"] = EMAIL_ADDRESS
-    msg["To"] = case["recipient_email"]
-    msg.set_content(f"""
-Dear {case['recipient']},
-
-This is a reminder regarding our Section 91 CrPC request sent on {case['sent_at'].strftime('%d-%m-%Y %H:%M')} for case {case['case_number']}.
+This is a reminder regarding our Section 91 CrPC request sent on {{ sent_at }} for case {{ case_number }}.
 We are awaiting a response.
 
 Kindly expedite the processing.
@@ -44,17 +32,44 @@ Regards,
 Investigation Officer
 """)
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        smtp.send_message(msg)
+# 48 hours ago
+cutoff = datetime.utcnow() - timedelta(hours=1)
+
+for station in worker_stations(db):
+    # Query for sent cases older than 48h and not yet followed up
+    pending = list(collection.find({
+        "station": station.key,
+        "status": "sent",
+        "sent_at": {"$lt": cutoff}
+    }))
+
+    # Log in only when this station has work; a station that cannot log in is reported and skipped
+    if not pending:
+        continue
+    try:
+        with smtp_session(station["sender_email"], station.sender_password) as smtp:
+            for case in pending:
+                msg = build_message(
+                    case["recipient_email"],
+                    f"⚠ Follow-Up: CrPC 91 Request – Case {case['case_number']}",
+                    FOLLOWUP_BODY.render(
+                        recipient=case["recipient"],
+                        sent_at=case["sent_at"].strftime("%d-%m-%Y %H:%M"),
+                        case_number=case["case_number"]
+                    ),
+                    sender=station["sender_email"]
+                )
+                send_message(smtp, msg)
 
-    # Update MongoDB
-    collection.update_one(
-        {"_id": case["_id"]},
-        {"$set": {
-            "status": "followed_up",
-            "followed_up_at": datetime.utcnow()
-        }}
-    )
+                # Update MongoDB
+                collection.update_one(
+                    {"_id": case["_id"]},
+                    {"$set": {
+                        "status": "followed_up",
+                        "followed_up_at": datetime.utcnow()
+                    }}
+                )
 
-    print(f"📨 Follow-up sent for case: {case['case_number']}")
\ No newline at end of file
+                print(f"📨 [{station.key}] Follow-up sent for case: {case['case_number']}")
+    except Exception as e:
+        print(f"❌ [{station.key}] Skipped: {e}")
\ No newline at end of file
@@ -0,0 +1,459 @@
+# loadtest.py (load and soak harness for the FastAPI service)
+#
+#   python loadtest.py upload   --rows 100 1000 10000 --concurrency 4 --duration 30
+#   python loadtest.py generate --concurrency 1 2 4 8 16 --duration 30
+#   python loadtest.py mixed    --concurrency 16 --duration 3600          # soak
+#   python loadtest.py mixed    --mode uvicorn --workers 2 --concurrency 8 16 32
+#
+# SMTP goes to an in-process sink; MongoDB must be a local server (or --mongo mock, asgi mode only).
+# Each run uses a throwaway database that is dropped afterwards.
+# In asgi mode the app shares this process with the load generator, so RSS/CPU include the
+# harness; soak figures and the workers-per-core recommendation need --mode uvicorn.
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Resource samples (RSS, CPU, thread-pool use) are taken this often
+SAMPLE_SECONDS = 1.0
+
+# ---------------------------- SMTP SINK ----------------------------
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP (EHLO/AUTH/MAIL/RCPT/DATA) for mailer.py; message bodies are discarded."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.reply("220 loadtest ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.split(b" ", 1)[0].strip().upper()
+            if verb in (b"EHLO", b"HELO"):
+                self.wfile.write(b"250-loadtest\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == b"AUTH":
+                self.reply("235 ok")
+            elif verb == b"DATA":
+                self.reply("354 go ahead")
+                size = 0
+                for body_line in self.rfile:
+                    if body_line == b".\r\n":
+                        break
+                    size += len(body_line)
+                self.server.messages += 1
+                self.server.bytes += size
+                self.reply("250 queued")
+            elif verb == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages = 0
+        self.bytes = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+# ---------------------------- SCENARIOS ----------------------------
+
+GENERATE_PAYLOAD = {
+    "officer_name": "Load Test", "designation": "SI", "police_station": "Load PS",
+    "contact_info": "load@example.com", "case_number": "LOAD-1", "recipient": "Nodal Officer",
+    "recipient_email": "nodal@example.com", "suspect_identifier": "user@upi",
+    "date_range": "01-06-2025 to 15-06-2025", "data_requested": "KYC and transaction logs",
+    "case_purpose": "Load test",
+}
+SAMPLE_TEXTS = [
+    "win money fast, 10x returns guaranteed", "see you at lunch", "bitcoin casino bonus",
+    "meeting moved to 4pm", "double your money with crypto", "happy birthday!",
+]
+
+
+def make_csv(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["username", "email", "text"])
+    for i in range(rows):
+        writer.writerow([f"user{i}", f"user{i}@example.com", random.choice(SAMPLE_TEXTS)])
+    return out.getvalue().encode("utf-8")
+
+
+def scenarios(rows):
+    """name -> list of (weight, label, request kwargs). CSV bodies are built once, not per request."""
+    uploads = {n: make_csv(n) for n in rows}
+
+    def upload(n):
+        return ("POST", "/upload", {"files": {"file": (f"load_{n}.csv", uploads[n], "text/csv")}})
+
+    small = min(rows)
+    return {
+        "upload": [(1, f"upload[{n}]", upload(n)) for n in rows],
+        "generate": [(1, "generate", ("POST", "/generate", {"json": GENERATE_PAYLOAD}))],
+        "mixed": [
+            (3, f"upload[{small}]", upload(small)),
+            (2, "send-warnings", ("POST", "/send-warnings", {})),
+            (1, "escalate", ("POST", "/escalate", {})),
+            (1, "generate", ("POST", "/generate", {"json": GENERATE_PAYLOAD})),
+            (2, "list-files", ("GET", "/list-files", {})),
+            (2, "root", ("GET", "/", {})),
+        ],
+    }
+
+
+def seed_escalations(db, count=50):
+    """Cases already past the 72h window, so /escalate has PDF work to do in mixed runs."""
+    sent = datetime.utcnow() - timedelta(hours=96)
+    db["flagged_messages"].insert_many([
+        {"station": os.getenv("DEFAULT_STATION", "hyd-hq"), "username": f"seed{i}",
+         "email": f"seed{i}@example.com", "text": "win money", "status": "warning_sent",
+         "warning_sent_at": sent, "flagged_at": sent}
+        for i in range(count)
+    ])
+
+# ---------------------------- TARGETS ----------------------------
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def _cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return 0.0
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+class AsgiTarget:
+    """The app imported into this process and driven through httpx's ASGI transport."""
+
+    workers = 1
+    # RSS/CPU samples of this process include the load generator and SMTP sink
+    includes_harness = True
+
+    def __init__(self, env, mongo):
+        os.environ.update(env)
+        if mongo == "mock":
+            import mongomock  # optional; only needed for --mongo mock
+            import pymongo
+            pymongo.MongoClient = mongomock.MongoClient
+        sys.path.insert(0, REPO_DIR)
+        import main
+        self.app = main.app
+        self.db = main.db
+        self.pids = [os.getpid()]
+        os.chdir(env["LOADTEST_WORKDIR"])
+
+    def client(self):
+        # App exceptions become 500s and are counted as errors, as they would be behind uvicorn
+        transport = httpx.ASGITransport(app=self.app, raise_app_exceptions=False)
+        return httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None)
+
+    def thread_pool_usage(self):
+        # Sync endpoints run on anyio's default thread limiter (40 tokens)
+        import anyio.to_thread
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        return limiter.borrowed_tokens / limiter.total_tokens
+
+    def close(self):
+        pass
+
+
+class UvicornTarget:
+    """A local `uvicorn main:app --workers N`, driven over HTTP like render.yaml runs it."""
+
+    includes_harness = False
+
+    def __init__(self, env, workers, port=8765):
+        from pymongo import MongoClient
+        self.workers = workers
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_DIR, "--host", "127.0.0.1",
+             "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+            cwd=env["LOADTEST_WORKDIR"], env={**os.environ, **env},
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(self.base_url + "/", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.5)
+        else:
+            self.close()
+            raise RuntimeError("uvicorn did not start within 60s")
+        self.db = MongoClient(env["MONGO_URI"])[env["MONGO_DB"]]
+
+    @property
+    def pids(self):
+        return _children(self.proc.pid) or [self.proc.pid]
+
+    def client(self):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        return httpx.AsyncClient(base_url=self.base_url, timeout=None, limits=limits)
+
+    def thread_pool_usage(self):
+        return None
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait(timeout=30)
+
+# ---------------------------- DRIVER ----------------------------
+
+class LatencyHistogram:
+    """Log-bucketed latencies (~5% resolution) in fixed memory, however long the run."""
+
+    MIN_SECONDS = 1e-4
+    GROWTH = 1.05
+    BUCKETS = 400  # 0.1 ms up to ~8 h
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            index = 0
+        else:
+            index = min(self.BUCKETS - 1, int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1)
+        self.counts[index] += 1
+        self.total += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Upper edge of the bucket holding the q-th latency (capped at the observed max)."""
+        if not self.total:
+            return None
+        rank, seen = max(1, math.ceil(q * self.total)), 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** index)
+        return self.max
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+async def _sampler(target, samples, stop):
+    pids = target.pids
+    cpu0 = sum(_cpu_seconds(p) for p in pids)
+    start = time.monotonic()
+    while not stop.is_set():
+        tick = time.monotonic()
+        await asyncio.sleep(SAMPLE_SECONDS)
+        lag = time.monotonic() - tick - SAMPLE_SECONDS
+        samples.append({
+            "t": round(time.monotonic() - start, 1),
+            "rss_bytes": sum(_rss_bytes(p) for p in pids),
+            "cpu_seconds": sum(_cpu_seconds(p) for p in pids) - cpu0,
+            "thread_pool": target.thread_pool_usage(),
+            "loop_lag_ms": round(lag * 1000, 1),
+        })
+
+
+async def run_level(target, mix, concurrency, duration, requests):
+    weights = [w for w, _, _ in mix]
+    latencies, per_label, errors, samples = LatencyHistogram(), {}, [0], []
+    stop = asyncio.Event()
+    deadline = time.monotonic() + duration if duration else None
+    remaining = [requests] if requests else None
+
+    async with target.client() as client:
+        async def worker():
+            while not stop.is_set():
+                if deadline and time.monotonic() >= deadline:
+                    return
+                if remaining is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                _, label, (method, url, kwargs) = random.choices(mix, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                elapsed = time.perf_counter() - started
+                latencies.add(elapsed)
+                per_label.setdefault(label, LatencyHistogram()).add(elapsed)
+                if status == 0 or status >= 500:
+                    errors[0] += 1
+
+        sampler = asyncio.create_task(_sampler(target, samples, stop))
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.monotonic() - started
+        stop.set()
+        await sampler
+    return summarize(latencies, per_label, errors[0], samples, wall, concurrency, target)
+
+
+def summarize(latencies, per_label, errors, samples, wall, concurrency, target):
+    rss = [s["rss_bytes"] for s in samples if s["rss_bytes"]]
+    cpu = samples[-1]["cpu_seconds"] if samples else 0.0
+    pool = [s["thread_pool"] for s in samples if s["thread_pool"] is not None]
+    hours = wall / 3600
+    return {
+        "concurrency": concurrency,
+        "requests": latencies.total,
+        "errors": errors,
+        "throughput_rps": round(latencies.total / wall, 2) if wall else 0,
+        "latency_ms": {q: round(latencies.percentile(p) * 1000, 1) if latencies.total else None
+                       for q, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+        "per_endpoint_p90_ms": {k: round(v.percentile(0.9) * 1000, 1) for k, v in sorted(per_label.items())},
+        # asgi mode: RSS and CPU below are app + load generator + SMTP sink, not the app alone
+        "resources_include_harness": target.includes_harness,
+        "rss_mb": {"start": round(rss[0] / 2**20, 1), "end": round(rss[-1] / 2**20, 1),
+                   "growth_mb_per_hour": round((rss[-1] - rss[0]) / 2**20 / hours, 1) if hours else None}
+                  if rss else None,
+        # CPU per worker as a fraction of one core; well below 1.0 means the worker is waiting, not computing
+        "cpu_per_worker": round(cpu / wall / target.workers, 3) if wall else None,
+        "thread_pool_peak": round(max(pool), 2) if pool else None,
+        "loop_lag_p99_ms": percentile([s["loop_lag_ms"] for s in samples], 0.99),
+    }
+
+
+def recommend(levels):
+    """Workers per core from the best-throughput level: enough workers to keep one core busy.
+
+    Only meaningful for uvicorn runs, where CPU is sampled from the worker processes alone.
+    """
+    if any(lv["resources_include_harness"] for lv in levels):
+        return None
+    healthy = [lv for lv in levels if lv["requests"] and lv["errors"] / lv["requests"] < 0.01] or levels
+    best = max(healthy, key=lambda lv: lv["throughput_rps"])
+    cpu = best["cpu_per_worker"] or 1.0
+    per_core = max(1, min(4, round(1 / max(cpu, 0.05))))
+    return {
+        "saturation_concurrency": best["concurrency"],
+        "max_throughput_rps": best["throughput_rps"],
+        "cpu_per_worker": cpu,
+        "workers_per_core": per_core,
+        "suggested_start_command": f"uvicorn main:app --host 0.0.0.0 --port 10000 --workers {per_core * (os.cpu_count() or 1)}",
+    }
+
+# ---------------------------- CLI ----------------------------
+
+def print_level(level):
+    lat = level["latency_ms"]
+    rss = level["rss_mb"] or {}
+    harness = " (incl. harness)" if level["resources_include_harness"] else ""
+    print(f"⚙ c={level['concurrency']:>3} | {level['throughput_rps']:>8} req/s | "
+          f"p50 {lat['p50']} ms p90 {lat['p90']} ms p99 {lat['p99']} ms | errors {level['errors']} | "
+          f"cpu/worker{harness} {level['cpu_per_worker']} | pool {level['thread_pool_peak']} | "
+          f"rss{harness} {rss.get('start')}→{rss.get('end')} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and soak test the CrPC FastAPI service.")
+    parser.add_argument("scenario", choices=["upload", "generate", "mixed"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per concurrency level")
+    parser.add_argument("--requests", type=int, default=0, help="stop each level after N requests instead")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000], help="CSV upload sizes")
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (uvicorn mode)")
+    parser.add_argument("--mongo", choices=["local", "mock"], default="local")
+    parser.add_argument("--json", help="write the full report here")
+    args = parser.parse_args()
+    if args.requests:
+        args.duration = 0
+
+    mongo_uri = os.getenv("LOADTEST_MONGO_URI", "mongodb://localhost:27017")
+    if args.mongo == "local" and urlparse(mongo_uri).hostname not in LOCAL_HOSTS:
+        sys.exit("❌ Refusing to load-test a non-local MongoDB; set LOADTEST_MONGO_URI to a local server.")
+    if args.mongo == "mock" and args.mode == "uvicorn":
+        sys.exit("❌ --mongo mock only works in asgi mode (the mock is per-process).")
+
+    sink = SMTPSink()
+    workdir = tempfile.mkdtemp(prefix="crpc-loadtest-")
+    # Seeded and uploaded cases go to a throwaway database, dropped when the run ends
+    database = f"crpc_loadtest_{uuid.uuid4().hex[:8]}"
+    env = {
+        "MONGO_URI": mongo_uri, "MONGO_DB": database, "STATIONS_DB": database, "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(sink.start()), "SMTP_USE_SSL": "0",
+        "EMAIL_ADDRESS": "loadtest@example.com", "EMAIL_PASSWORD": "loadtest", "LOADTEST_WORKDIR": workdir,
+    }
+    target = UvicornTarget(env, args.workers) if args.mode == "uvicorn" else AsgiTarget(env, args.mongo)
+    mix = scenarios(args.rows)[args.scenario]
+    if args.scenario == "mixed":
+        seed_escalations(target.db)
+
+    print(f"🚀 {args.scenario} | mode={args.mode} workers={target.workers} | outputs in {workdir}")
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            level = asyncio.run(run_level(target, mix, concurrency, args.duration, args.requests))
+            levels.append(level)
+            print_level(level)
+    finally:
+        target.close()
+        sink.shutdown()
+        target.db.client.drop_database(database)
+
+    report = {"scenario": args.scenario, "mode": args.mode, "workers": target.workers,
+              "cpu_count": os.cpu_count(), "smtp_messages": sink.messages, "levels": levels,
+              "recommendation": recommend(levels)}
+    if report["recommendation"] is None:
+        print("📊 No workers-per-core recommendation: asgi figures include the harness; rerun with --mode uvicorn.")
+    else:
+        print(f"📊 Recommendation: {report['recommendation']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
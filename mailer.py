@@ -0,0 +1,310 @@
+# mailer.py (shared outbound email layer)
+
+import base64
+import os
+import re
+import smtplib
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.header import Header
+from email.utils import formatdate, make_msgid
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from jinja2 import Template
+
+# Load environment variables
+load_dotenv()
+EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+# Plain (non-TLS) SMTP, for local stand-ins such as the load-test sink
+SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "1") != "0"
+
+# Encoded attachment parts kept around for reuse (same PDF -> many recipients)
+ATTACHMENT_CACHE_SIZE = 32
+
+# SMTP line limit (RFC 5321, excluding CRLF) and the preferred header line length (RFC 5322)
+MAX_LINE = 998
+MAX_HEADER_LINE = 78
+
+CRLF = b"\r\n"
+_LEADING_DOT = re.compile(rb"(?m)^\.")
+
+# ---------------------------- TEMPLATES ----------------------------
+
+@lru_cache(maxsize=None)
+def body_template(source):
+    """Compile a plain-text body template once; callers keep the result at module level."""
+    return Template(source, keep_trailing_newline=True)
+
+# ---------------------------- ATTACHMENTS ----------------------------
+
+class EncodedAttachment:
+    """A fully serialized MIME part (headers + base64 body), built once per file version."""
+
+    def __init__(self, path, maintype="application", subtype="pdf"):
+        self.path = path
+        self.filename = os.path.basename(path)
+        with open(path, "rb") as f:
+            encoded = base64.encodebytes(f.read()).replace(b"\n", CRLF)
+        headers = (
+            f"Content-Type: {maintype}/{subtype}\r\n"
+            f"Content-Transfer-Encoding: base64\r\n"
+            f'Content-Disposition: attachment; filename="{self.filename}"\r\n'
+            f"\r\n"
+        ).encode("ascii")
+        # base64 lines never start with ".", so this part needs no dot-stuffing
+        self.data = headers + encoded
+
+    def __len__(self):
+        return len(self.data)
+
+
+_attachment_cache = OrderedDict()
+_attachment_lock = threading.Lock()
+
+def load_attachment(path, maintype="application", subtype="pdf"):
+    """Return the cached encoded part for `path`, re-encoding only if the file changed."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, maintype, subtype)
+    # Sends run on FastAPI's thread pool; the LRU bookkeeping must not interleave
+    with _attachment_lock:
+        part = _attachment_cache.get(key)
+        if part is not None:
+            _attachment_cache.move_to_end(key)
+            return part
+    # Encode outside the lock so one large file does not stall other sends
+    part = EncodedAttachment(path, maintype, subtype)
+    with _attachment_lock:
+        _attachment_cache[key] = part
+        if len(_attachment_cache) > ATTACHMENT_CACHE_SIZE:
+            _attachment_cache.popitem(last=False)
+    return part
+
+
+def clear_attachment_cache():
+    with _attachment_lock:
+        _attachment_cache.clear()
+
+# ---------------------------- MESSAGES ----------------------------
+
+def _header(name, value):
+    # A CR/LF in a value (e.g. a user-supplied case number) would start a new header
+    if "\r" in value or "\n" in value:
+        raise ValueError(f"Header {name!r} must not contain CR or LF")
+    line = f"{name}: {value}"
+    if not line.isascii():
+        line = f"{name}: " + Header(value, "utf-8", header_name=name).encode(linesep="\r\n")
+    elif len(line) > MAX_HEADER_LINE:
+        line = f"{name}: " + Header(value, "us-ascii", header_name=name).encode(linesep="\r\n")
+        # No whitespace to fold at: encoded words can be split anywhere
+        if any(len(part) > MAX_LINE for part in line.split("\r\n")):
+            line = f"{name}: " + Header(value, "utf-8", header_name=name).encode(linesep="\r\n")
+    return line.encode("ascii") + CRLF
+
+
+def _text_part(body):
+    body = body.replace("\r\n", "\n")
+    if not body.endswith("\n"):
+        body += "\n"
+    lines = body.split("\n")
+    # 7bit only when it is valid on the wire: ASCII, no bare CR, no line over the SMTP limit
+    if body.isascii() and "\r" not in body and all(len(line) <= MAX_LINE for line in lines):
+        payload = _LEADING_DOT.sub(b"..", body.replace("\n", "\r\n").encode("ascii"))
+        cte = b"7bit"
+    else:
+        payload = base64.encodebytes(body.encode("utf-8")).replace(b"\n", CRLF)
+        cte = b"base64"
+    return (
+        b'Content-Type: text/plain; charset="utf-8"\r\n'
+        b"Content-Transfer-Encoding: " + cte + CRLF + CRLF + payload
+    )
+
+
+class OutgoingMessage:
+    """A message held as a list of wire-ready chunks; attachment chunks are shared, not copied."""
+
+    def __init__(self, to_address, subject, body, attachments=(), sender=None, message_id=None,
+                 extra_headers=None):
+        self.sender = sender or EMAIL_ADDRESS
+        self.to_address = to_address
+        self.message_id = message_id or make_msgid(domain=_sender_domain(self.sender))
+        self.attachments = list(attachments)
+
+        head = [
+            _header("From", self.sender),
+            _header("To", to_address),
+            _header("Subject", subject),
+            _header("Date", formatdate(localtime=True)),
+            _header("Message-ID", self.message_id),
+        ]
+        for name, value in (extra_headers or {}).items():
+            head.append(_header(name, value))
+        head.append(b"MIME-Version: 1.0\r\n")
+
+        text = _text_part(body)
+        if not self.attachments:
+            self.chunks = [b"".join(head), text]
+            return
+
+        boundary = ("=_" + make_msgid().strip("<>").replace("@", ".")).encode("ascii")
+        head.append(b'Content-Type: multipart/mixed; boundary="' + boundary + b'"\r\n\r\n')
+        delimiter = b"--" + boundary + CRLF
+        self.chunks = [b"".join(head), delimiter, text]
+        for part in self.attachments:
+            self.chunks += [delimiter, part.data]
+        self.chunks.append(b"--" + boundary + b"--\r\n")
+
+    def __len__(self):
+        return sum(len(c) for c in self.chunks)
+
+
+def _sender_domain(sender):
+    return sender.rpartition("@")[2] if sender and "@" in sender else None
+
+
+def build_message(to_address, subject, body, attachment_path=None, **kwargs):
+    attachments = [load_attachment(attachment_path)] if attachment_path else []
+    return OutgoingMessage(to_address, subject, body, attachments, **kwargs)
+
+# ---------------------------- SMTP ----------------------------
+
+@contextmanager
+def smtp_session(address=None, password=None):
+    """One authenticated connection reused for a whole batch of sends.
+
+    Without `address` the default account is used; an explicit mailbox must come with its own
+    password, never the default one.
+    """
+    if address is None:
+        address, password = EMAIL_ADDRESS, EMAIL_PASSWORD
+    if not password:
+        raise RuntimeError(f"No SMTP password configured for {address}")
+    smtp_class = smtplib.SMTP_SSL if SMTP_USE_SSL else smtplib.SMTP
+    with smtp_class(SMTP_HOST, SMTP_PORT) as smtp:
+        smtp.login(address, password)
+        yield smtp
+
+
+def send_message(smtp, message):
+    """Stream `message` chunk by chunk through DATA instead of flattening it first."""
+    smtp.ehlo_or_helo_if_needed()
+    code, resp = smtp.mail(message.sender)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, message.sender)
+    code, resp = smtp.rcpt(message.to_address)
+    if code not in (250, 251):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused({message.to_address: (code, resp)})
+    smtp.putcmd("data")
+    code, resp = smtp.getreply()
+    if code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in message.chunks:
+        smtp.send(chunk)
+    smtp.send(b".\r\n")
+    code, resp = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return message.message_id
+
+
+def send_email(to_address, subject, body, attachment_path=None, smtp=None, **kwargs):
+    message = build_message(to_address, subject, body, attachment_path, **kwargs)
+    if smtp is not None:
+        return send_message(smtp, message)
+    with smtp_session() as session:
+        return send_message(session, message)
+
+# ---------------------------- BENCHMARK ----------------------------
+
+class NullSMTP:
+    """Accepts the SMTP calls made by send_message and discards the bytes."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self._replies = []
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        return 250, b"OK"
+
+    def rcpt(self, recipient):
+        return 250, b"OK"
+
+    def rset(self):
+        pass
+
+    def putcmd(self, cmd):
+        self._replies.append(354 if cmd == "data" else 250)
+
+    def send(self, data):
+        self.bytes_sent += len(data)
+        if data == b".\r\n":
+            self._replies.append(250)
+
+    def getreply(self):
+        return self._replies.pop(0), b"OK"
+
+
+def benchmark(messages=200, attachment_path=None):
+    """Per-message CPU time and allocation for warning-style and PDF-bearing sends.
+
+    `escalation_shared_pdf` re-sends one file (cache hits after the first message);
+    `escalation_fresh_pdf` clears the cache per message, like real escalations that write a new PDF.
+    """
+    warning = body_template(
+        "Dear {{ username }},\n\nWe found suspicious content in your message:\n---\n{{ text }}\n---\n\n"
+        "Please reply within 48 hours.\n\nRegards,\nCyber Monitoring Unit"
+    )
+    if attachment_path is None:
+        pdfs = sorted(f for f in os.listdir("outputs") if f.endswith(".pdf")) if os.path.isdir("outputs") else []
+        attachment_path = os.path.join("outputs", pdfs[-1]) if pdfs else None
+
+    scenarios = {"warning": (None, False)}
+    if attachment_path:
+        scenarios["escalation_shared_pdf"] = (attachment_path, False)
+        scenarios["escalation_fresh_pdf"] = (attachment_path, True)
+
+    def send_all(smtp, path, cold):
+        clear_attachment_cache()
+        for i in range(messages):
+            if cold:
+                clear_attachment_cache()
+            body = warning.render(username=f"user{i}", text="win money with 10x returns")
+            send_message(smtp, build_message(f"user{i}@example.com", "⚠ Suspicious Activity Detected",
+                                             body, path, sender="monitor@example.com"))
+
+    results = {}
+    for name, (path, cold) in scenarios.items():
+        # Timed pass runs untraced; tracemalloc overhead would otherwise dominate the CPU figure
+        smtp = NullSMTP()
+        start = time.process_time()
+        send_all(smtp, path, cold)
+        cpu = time.process_time() - start
+
+        # Separate traced pass for the allocation peak
+        tracemalloc.start()
+        send_all(NullSMTP(), path, cold)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "cpu_us_per_message": round(cpu / messages * 1e6, 1),
+            "peak_alloc_bytes": peak,
+            "bytes_per_message": smtp.bytes_sent // messages,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    for name, stats in benchmark().items():
+        print(f"📊 {name}: {stats}")
@@ -1,37 +1,41 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from typing import List, Optional
 from jinja2 import Template
 from datetime import datetime, timedelta
 from weasyprint import HTML
 from dotenv import load_dotenv
 from pymongo import MongoClient
-import smtplib, os, uuid, csv, io, re
-from email.message import EmailMessage
+import os, uuid, csv, io
 import imaplib
-import email
-from email.header import decode_header
+from mailer import body_template, build_message, send_email, send_message, smtp_session
+from replies import cursor_key, process_inbox
+from export import load_rollups
+from membership import MembershipCache
+from rules import RuleStore, save_rules
+from stations import (DEFAULT_STATION, ensure_station_indexes, get_station, load_stations, mailbox_groups,
+                      worker_stations)
 
 # Load environment variables
 load_dotenv()
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 MONGO_URI = os.getenv("MONGO_URI")  # MongoDB Atlas URI
+MONGO_DB = os.getenv("MONGO_DB", "crpcdb")
 
 # MongoDB setup
 client = MongoClient(MONGO_URI)
-db = client["crpcdb"]  # Use your actual DB name here
+db = client[MONGO_DB]  # Use your actual DB name here
 flagged_collection = db["flagged_messages"]
 crpc_collection = db["crpc_requests"]
+ensure_station_indexes(flagged_collection, crpc_collection)
+membership = MembershipCache(flagged_collection).build()
 
 app = FastAPI()
 
-# Suspicious keywords
-SUSPICIOUS_KEYWORDS = [
-    "betting", "crypto", "money laundering", "nude", "drug", "blackmail",
-    "dark web", "bitcoin", "casino", "win money", "10x returns", "double your money"
-]
-pattern = re.compile(r"|".join(re.escape(word) for word in SUSPICIOUS_KEYWORDS), re.IGNORECASE)
+# Keyword rules (see rules.py); hot-reloaded from the rule_sets collection
+rule_store = RuleStore(db)
 
 # ---------------------------- MODELS ----------------------------
 class CrPCData(BaseModel):
@@ -46,6 +50,7 @@ class CrPCData(BaseModel):
     date_range: str
     data_requested: str
     case_purpose: str
+    station: Optional[str] = None
 
 # ---------------------------- TEMPLATE ----------------------------
 TEMPLATE_HTML = """
@@ -72,6 +77,20 @@ TEMPLATE_HTML = """
 </body>
 </html>
 """
+CRPC_TEMPLATE = Template(TEMPLATE_HTML)
+
+WARNING_SUBJECT = "⚠ Suspicious Activity Detected"
+WARNING_BODY = body_template("""Dear {{ username }},
+
+We found suspicious content in your message:
+---
+{{ text }}
+---
+
+Please reply within 48 hours. If no response is received, legal action may be initiated.
+
+Regards,
+Cyber Monitoring Unit""")
 
 # ---------------------------- ENDPOINTS ----------------------------
 
@@ -80,162 +99,191 @@ def root(request: Request):
     return {"message": "🚀 CrPC FastAPI server is running."}
 
 @app.post("/upload")
-async def upload_csv(file: UploadFile = File(...)):
+async def upload_csv(file: UploadFile = File(...), station: Optional[str] = None):
     if not file.filename.endswith(".csv"):
         raise HTTPException(status_code=400, detail="Only CSV files are supported.")
+    if station and get_station(db, station) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown station: {station}")
     
     contents = await file.read()
     decoded = contents.decode("utf-8")
     reader = csv.DictReader(io.StringIO(decoded))
 
-    flagged = 0
+    # One matcher for the whole upload, even if the rules are swapped mid-way
+    matcher = rule_store.current()
+    to_flag = []
     for row in reader:
         text = row.get("text", "")
-        suspicion_score = len(pattern.findall(text))
-        if suspicion_score >= 1:
-            row["suspicion_score"] = suspicion_score
-            row["flagged_at"] = datetime.utcnow()
-            row["status"] = "warning_pending"
-            flagged_collection.insert_one(row)
-            flagged += 1
-    return {"message": f"✅ Uploaded and flagged {flagged} messages."}
-
-@app.post("/send-warnings")
-def send_warnings():
-    count = 0
-    for user in flagged_collection.find({"status": "warning_pending"}):
-        email_addr = user.get("email")
-        if not email_addr:
-            continue
-        msg = EmailMessage()
-        msg["Subject"] = "⚠ Suspicious Activity Detected"
-        msg["From"] = EMAIL_ADDRESS
-        msg["To"] = email_addr
-        msg.set_content(f"""Dear {user.get('username','User')},
+        scan = matcher.scan(text)
+        if scan.score >= 1:
+            row["station"] = station or row.get("station") or DEFAULT_STATION
+            row.update(scan.as_fields())
+            to_flag.append(row)
 
-We found suspicious content in your message:
----
-{text := user.get('text','')}
----
+    # A flag for an unregistered station would never be warned or escalated
+    unknown = {row["station"] for row in to_flag} - set(load_stations(db))
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown station: {', '.join(sorted(unknown))}")
 
-Please reply within 48 hours. If no response is received, legal action may be initiated.
+    for row in to_flag:
+        row["flagged_at"] = datetime.utcnow()
+        row["status"] = "warning_pending"
+        flagged_collection.insert_one(row)
+        if membership.record(row):
+            membership.build()
+    return {"message": f"✅ Uploaded and flagged {len(to_flag)} messages."}
 
-Regards,
-Cyber Monitoring Unit""")
+def _each_station(stations, tick):
+    """Run `tick` per station; a login or send failure at one station is reported, not fatal."""
+    done, failed = {}, {}
+    for st in stations:
         try:
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-                smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                smtp.send_message(msg)
-            flagged_collection.update_one(
-                {"_id": user["_id"]},
-                {"$set": {"status": "warning_sent", "warning_sent_at": datetime.utcnow()}}
-            )
-            count += 1
+            done[st.key] = tick(st)
         except Exception as e:
-            print(f"❌ Could not send to {email_addr}: {e}")
-    return {"message": f"✅ Sent warnings to {count} users."}
+            print(f"❌ [{st.key}] {e}")
+            failed[st.key] = str(e)
+    return done, failed
 
-@app.post("/check-replies")
-def check_replies():
-    imap = imaplib.IMAP4_SSL("imap.gmail.com")
-    imap.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-    imap.select("inbox")
-    status, messages = imap.search(None, 'UNSEEN')
-    if status != "OK":
-        return {"message": "❌ No unseen messages"}
-
-    found = 0
-    for num in messages[0].split():
-        _, msg_data = imap.fetch(num, "(RFC822)")
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                sender = email.utils.parseaddr(msg.get("From"))[1]
-                user = flagged_collection.find_one({"email": sender, "status": "warning_sent"})
-                if not user:
-                    continue
-                body = ""
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            body = part.get_payload(decode=True).decode()
-                            break
-                else:
-                    body = msg.get_payload(decode=True).decode()
+def _send_station_warnings(st):
+    count = 0
+    subject = st["warning_subject"] or WARNING_SUBJECT
+    template = body_template(st["warning_body"]) if st["warning_body"] else WARNING_BODY
+    pending = list(flagged_collection.find({"station": st.key, "status": "warning_pending"}))
+    # No SMTP login for a station with nothing to send
+    if not pending:
+        return 0
+    with smtp_session(st["sender_email"], st.sender_password) as smtp:
+        for user in pending:
+            email_addr = user.get("email")
+            if not email_addr:
+                continue
+            msg = build_message(email_addr, subject, template.render(
+                username=user.get("username", "User"),
+                text=user.get("text", ""),
+                station=st
+            ), sender=st["sender_email"])
+            try:
+                send_message(smtp, msg)
                 flagged_collection.update_one(
                     {"_id": user["_id"]},
-                    {"$set": {
-                        "status": "responded",
-                        "responded_at": datetime.utcnow(),
-                        "reply_content": body.strip()[:1000],
-                        "responded": True
-                    }}
+                    {"$set": {"status": "warning_sent", "warning_sent_at": datetime.utcnow(),
+                              "warning_message_id": msg.message_id},
+                     "$addToSet": {"outbound_message_ids": msg.message_id}}
                 )
-                found += 1
-    imap.logout()
-    return {"message": f"✅ Processed {found} replies."}
+                membership.record({"outbound_message_ids": [msg.message_id]})
+                count += 1
+            except Exception as e:
+                print(f"❌ Could not send to {email_addr}: {e}")
+    return count
 
-@app.post("/escalate")
-def escalate_and_send():
+@app.post("/send-warnings")
+def send_warnings(station: Optional[str] = None):
+    sent, failed = _each_station(worker_stations(db, station), _send_station_warnings)
+    return {"message": f"✅ Sent warnings to {sum(sent.values())} users.", "stations": sent, "failed": failed}
+
+@app.post("/check-replies")
+def check_replies(station: Optional[str] = None):
+    totals, failed = {}, {}
+    membership.refresh()
+    # One pass per inbox, matching cases of every station that shares it
+    for st, keys in mailbox_groups(worker_stations(db, station)):
+        label = ",".join(keys)
+        try:
+            imap = imaplib.IMAP4_SSL(st["imap_host"])
+            imap.login(st["sender_email"], st.sender_password)
+            imap.select("inbox")
+            counts = process_inbox(imap, flagged_collection,
+                                   {"station": {"$in": keys}, "status": {"$in": ["warning_sent", "followup_sent"]}},
+                                   cache=membership, cursor=cursor_key(st["imap_host"], st["sender_email"], keys))
+            imap.logout()
+        except Exception as e:
+            print(f"❌ [{label}] {e}")
+            failed[label] = str(e)
+            continue
+        if counts is not None:
+            totals[label] = counts
+    if not totals:
+        return {"message": "❌ No unseen messages", "failed": failed}
+    found = sum(c["genuine"] for c in totals.values())
+    return {"message": f"✅ Processed {found} replies.", "stations": totals, "failed": failed}
+
+def _escalate_station(st):
     cutoff = datetime.utcnow() - timedelta(hours=72)
     to_escalate = list(flagged_collection.find({
+        "station": st.key,
         "status": "warning_sent",
         "responded": {"$ne": True},
         "warning_sent_at": {"$lte": cutoff}
     }))
+    if not to_escalate:
+        return 0
 
     count = 0
-    for user in to_escalate:
-        html = Template(TEMPLATE_HTML).render(
-            officer_name="Inspector General",
-            designation="Cyber Cell",
-            police_station="Hyderabad HQ",
-            contact_info="cybercell@hyderabadpolice.gov.in",
-            case_number=f"CASE-{uuid.uuid4().hex[:8].upper()}",
-            recipient=user.get("username", "User"),
-            suspect_identifier=user.get("username", ""),
-            date_range="Last 30 days",
-            data_requested=f"All messages related to: {user.get('text','')}",
-            case_purpose="Legal investigation of flagged cyber activity",
-            generated_on=datetime.now().strftime("%Y-%m-%d %H:%M")
-        )
-
-        filename = f"crpc_{uuid.uuid4().hex}.pdf"
-        filepath = os.path.join("outputs", filename)
-        os.makedirs("outputs", exist_ok=True)
-        HTML(string=html).write_pdf(filepath)
-
-        send_email(
-            to_address=user.get("email"),
-            subject="CrPC 91 Notice",
-            body="Attached is a legal notice under CrPC 91 regarding your activity.",
-            attachment_path=filepath
-        )
-
-        flagged_collection.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"status": "escalated", "escalated_at": datetime.utcnow()}}
-        )
-
-        crpc_collection.insert_one({
-            "user": user.get("username"),
-            "email": user.get("email"),
-            "pdf": filename,
-            "sent_at": datetime.utcnow()
-        })
-        count += 1
-
-    return {"message": f"🚨 Escalated and sent CrPC to {count} users."}
+    with smtp_session(st["sender_email"], st.sender_password) as smtp:
+        for user in to_escalate:
+            html = CRPC_TEMPLATE.render(
+                officer_name=st["officer_name"],
+                designation=st["designation"],
+                police_station=st["police_station"],
+                contact_info=st["contact_info"],
+                case_number=f"CASE-{uuid.uuid4().hex[:8].upper()}",
+                recipient=user.get("username", "User"),
+                suspect_identifier=user.get("username", ""),
+                date_range="Last 30 days",
+                data_requested=f"All messages related to: {user.get('text','')}",
+                case_purpose="Legal investigation of flagged cyber activity",
+                generated_on=datetime.now().strftime("%Y-%m-%d %H:%M")
+            )
+
+            filename = f"crpc_{uuid.uuid4().hex}.pdf"
+            filepath = os.path.join("outputs", filename)
+            os.makedirs("outputs", exist_ok=True)
+            HTML(string=html).write_pdf(filepath)
+
+            send_email(
+                to_address=user.get("email"),
+                subject="CrPC 91 Notice",
+                body="Attached is a legal notice under CrPC 91 regarding your activity.",
+                attachment_path=filepath,
+                smtp=smtp,
+                sender=st["sender_email"]
+            )
+
+            flagged_collection.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"status": "escalated", "escalated_at": datetime.utcnow()}}
+            )
+
+            crpc_collection.insert_one({
+                "station": st.key,
+                "user": user.get("username"),
+                "email": user.get("email"),
+                "pdf": filename,
+                "sent_at": datetime.utcnow()
+            })
+            count += 1
+    return count
+
+@app.post("/escalate")
+def escalate_and_send(station: Optional[str] = None):
+    escalated, failed = _each_station(worker_stations(db, station), _escalate_station)
+    return {"message": f"🚨 Escalated and sent CrPC to {sum(escalated.values())} users.", "stations": escalated,
+            "failed": failed}
 
 @app.post("/generate")
 def generate_pdf(data: CrPCData):
-    html = Template(TEMPLATE_HTML).render(**data.dict(), generated_on=datetime.now().strftime("%Y-%m-%d %H:%M"))
+    st = get_station(db, data.station)
+    if st is None:
+        raise HTTPException(status_code=404, detail=f"Unknown station: {data.station}")
+    html = CRPC_TEMPLATE.render(**data.dict(), generated_on=datetime.now().strftime("%Y-%m-%d %H:%M"))
     filename = f"crpc_{uuid.uuid4().hex}.pdf"
     filepath = os.path.join("outputs", filename)
     os.makedirs("outputs", exist_ok=True)
     HTML(string=html).write_pdf(filepath)
-    send_email(data.recipient_email, f"CrPC Request - {data.case_number}", "See attached legal request", filepath)
-    crpc_collection.insert_one({**data.dict(), "filename": filename, "sent_at": datetime.utcnow()})
+    with smtp_session(st["sender_email"], st.sender_password) as smtp:
+        send_email(data.recipient_email, f"CrPC Request - {data.case_number}", "See attached legal request", filepath,
+                   smtp=smtp, sender=st["sender_email"])
+    crpc_collection.insert_one({**data.dict(), "station": st.key, "filename": filename, "sent_at": datetime.utcnow()})
     return {"message": "✅ CrPC request sent", "filename": filename}
 
 @app.get("/download/{filename}")
@@ -245,20 +293,37 @@ def download_file(filename: str):
         return FileResponse(path, media_type="application/pdf", filename=filename)
     raise HTTPException(status_code=404, detail="File not found")
 
+@app.get("/stats")
+def stats(station: Optional[str] = None):
+    # Served from the export snapshots (see export.py), never from the live collections
+    rollups = load_rollups()
+    if rollups is None:
+        raise HTTPException(status_code=404, detail="No analytics snapshot yet. Run export.py first.")
+    if station:
+        rollups = {
+            key: [r for r in rows if r.get("station") == station] if isinstance(rows, list) else rows
+            for key, rows in rollups.items()
+        }
+    return rollups
+
+@app.get("/rules")
+def get_rules():
+    matcher = rule_store.current()
+    return {"version": matcher.version, "rules": matcher.rules}
+
+@app.post("/rules")
+def put_rules(rules: List[dict]):
+    try:
+        version, _ = save_rules(db, rules)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rule: {e}")
+    rule_store.reload()
+    return {"message": f"✅ Rule set {version} is now active.", "version": version}
+
+@app.get("/metrics")
+def metrics():
+    return {"membership": membership.stats()}
+
 @app.get("/list-files")
 def list_files():
     return {"files": os.listdir("outputs") if os.path.exists("outputs") else []}
-
-# ---------------------------- UTILITY ----------------------------
-
-def send_email(to_address, subject, body, attachment_path):
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = EMAIL_ADDRESS
-    msg["To"] = to_address
-    msg.set_content(body)
-    with open(attachment_path, "rb") as f:
-        msg.add_attachment(f.read(), maintype="application", subtype="pdf", filename=os.path.basename(attachment_path))
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        smtp.send_message(msg)
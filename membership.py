@@ -0,0 +1,172 @@
+# membership.py (in-process Bloom filters that skip DB lookups for unknown senders/ids)
+
+import hashlib
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Target false-positive rate and starting capacity for each filter
+MEMBERSHIP_FP_RATE = float(os.getenv("MEMBERSHIP_FP_RATE", "0.01"))
+MEMBERSHIP_CAPACITY = int(os.getenv("MEMBERSHIP_CAPACITY", "100000"))
+
+# Incremental refreshes look back this far to cover clock skew between writers
+REFRESH_MARGIN = timedelta(minutes=1)
+
+# ---------------------------- BLOOM FILTER ----------------------------
+
+class BloomFilter:
+    """Fixed-size Bloom filter; `in` is False only for values that were never added."""
+
+    def __init__(self, capacity, fp_rate=MEMBERSHIP_FP_RATE):
+        self.capacity = max(int(capacity), 1)
+        self.fp_rate = fp_rate
+        self.size = max(8, int(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        # Setting a bit is read-modify-write; a lost update would be a false negative
+        self._lock = threading.Lock()
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        positions = list(self._positions(value))
+        with self._lock:
+            new = False
+            for pos in positions:
+                byte, mask = pos >> 3, 1 << (pos & 7)
+                if not self.bits[byte] & mask:
+                    self.bits[byte] |= mask
+                    new = True
+            # Approximate distinct count: values that set no new bit are treated as repeats
+            if new:
+                self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    def estimated_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+class KnownSet:
+    """A Bloom filter plus hit/miss counters; rebuild() resizes it for the values given."""
+
+    def __init__(self, name, capacity=MEMBERSHIP_CAPACITY):
+        self.name = name
+        self.filter = BloomFilter(capacity)
+        self.lookups = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    def might_contain(self, value):
+        self.lookups += 1
+        if value in self.filter:
+            return True
+        self.negatives += 1
+        return False
+
+    def record_false_positive(self, count=1):
+        """Call when the DB found nothing for a value (or `count` values) the filter let through."""
+        self.false_positives += count
+
+    def rebuild(self, values):
+        values = {v for v in values if v}
+        capacity = max(self.filter.capacity, len(values) * 2)
+        self.filter = BloomFilter(capacity, self.filter.fp_rate)
+        for value in values:
+            self.filter.add(value)
+
+    def add(self, value):
+        if value:
+            self.filter.add(value)
+        return self.filter.count > self.filter.capacity
+
+    def stats(self):
+        positives = self.lookups - self.negatives
+        return {
+            "items": self.filter.count,
+            "capacity": self.filter.capacity,
+            "bits": self.filter.size,
+            "hashes": self.filter.hashes,
+            "memory_bytes": self.filter.memory_bytes,
+            "estimated_fp_rate": round(self.filter.estimated_fp_rate(), 6),
+            "lookups": self.lookups,
+            "db_lookups_skipped": self.negatives,
+            "observed_fp_rate": round(self.false_positives / positives, 6) if positives else None,
+        }
+
+# ---------------------------- FLAGGED-MESSAGES CACHE ----------------------------
+
+class MembershipCache:
+    """Flagged emails, flagged message ids and outbound Message-IDs of one flagged_messages collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.emails = KnownSet("emails")
+        self.flag_ids = KnownSet("flag_ids")
+        self.outbound_ids = KnownSet("outbound_ids")
+        self.built_at = None
+        self.refreshed_at = None
+
+    def _sets(self):
+        return (self.emails, self.flag_ids, self.outbound_ids)
+
+    def build(self):
+        """Full load from a projection; needs no document bodies.
+
+        The lifecycle indexes refresh() relies on come from stations.ensure_station_indexes.
+        """
+        started = datetime.utcnow()
+        emails, ids, outbound = [], [], []
+        for doc in self.collection.find({}, {"email": 1, "outbound_message_ids": 1}):
+            ids.append(doc["_id"])
+            emails.append(doc.get("email"))
+            outbound.extend(doc.get("outbound_message_ids") or [])
+        self.emails.rebuild(emails)
+        self.flag_ids.rebuild(ids)
+        self.outbound_ids.rebuild(outbound)
+        self.built_at = self.refreshed_at = started
+        return self
+
+    def refresh(self):
+        """Pick up documents other processes flagged or mailed since the last build/refresh."""
+        if self.refreshed_at is None:
+            return self.build()
+        started = datetime.utcnow()
+        since = self.refreshed_at - REFRESH_MARGIN
+        changed = self.collection.find(
+            {"$or": [{"flagged_at": {"$gte": since}},
+                     {"warning_sent_at": {"$gte": since}},
+                     {"followup_sent_at": {"$gte": since}}]},
+            {"email": 1, "outbound_message_ids": 1},
+        )
+        full = False
+        for doc in changed:
+            full |= self.record(doc)
+        self.refreshed_at = started
+        return self.build() if full else self
+
+    def record(self, doc):
+        """Keep the filters current after a local write; True means a rebuild is due."""
+        full = self.flag_ids.add(doc.get("_id"))
+        full |= self.emails.add(doc.get("email"))
+        for message_id in doc.get("outbound_message_ids") or []:
+            full |= self.outbound_ids.add(message_id)
+        return full
+
+    def stats(self):
+        return {
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            **{s.name: s.stats() for s in self._sets()},
+        }
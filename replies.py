@@ -0,0 +1,264 @@
+# replies.py (inbound reply processing shared by /check-replies and check_replies.py)
+
+import email
+import re
+from datetime import datetime
+from email.header import decode_header, make_header
+from email.utils import parseaddr
+
+# Messages fetched per IMAP round trip
+REPLY_BATCH_SIZE = 50
+
+# Reply classes; only GENUINE replies move a case to "responded"
+GENUINE = "genuine"
+AUTO_REPLY = "auto_reply"
+BOUNCE = "bounce"
+FORWARDED = "forwarded"
+
+_MSGID = re.compile(r"<[^<>\s]+>")
+_UID = re.compile(rb"UID (\d+)")
+_UIDVALIDITY = re.compile(rb"UIDVALIDITY (\d+)")
+_BOUNCE_SENDERS = ("mailer-daemon", "postmaster", "mail-daemon")
+_AUTO_SUBJECTS = re.compile(
+    r"^\s*(auto(matic)?[ -]?(reply|response)|out of (the )?office|autoreply|auto:|away:|vacation)",
+    re.IGNORECASE,
+)
+_FORWARD_SUBJECTS = re.compile(r"^\s*(fwd?|fw)\s*:", re.IGNORECASE)
+_TAGS = re.compile(r"<[^>]+>")
+
+# ---------------------------- HEADERS ----------------------------
+
+def header_text(value):
+    if not value:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except (LookupError, UnicodeDecodeError, ValueError):
+        return str(value)
+
+
+def referenced_ids(headers):
+    """Message-IDs this message claims to answer, newest reference first."""
+    ids = _MSGID.findall(headers.get("In-Reply-To", "") or "")
+    ids += reversed(_MSGID.findall(headers.get("References", "") or ""))
+    return list(dict.fromkeys(ids))
+
+
+def classify(headers):
+    """Header-only triage so bounces and auto-replies never cost a body fetch.
+
+    X-Auto-Response-Suppress is not a marker: Outlook adds it to ordinary human mail to ask
+    *us* not to auto-reply.
+    """
+    sender = parseaddr(headers.get("From", ""))[1].lower()
+    local_part = sender.partition("@")[0]
+    content_type = (headers.get("Content-Type", "") or "").lower()
+    if (local_part in _BOUNCE_SENDERS
+            or "report-type=delivery-status" in content_type.replace('"', "").replace(" ", "")
+            or headers.get("X-Failed-Recipients")
+            or (headers.get("Return-Path", "") or "").strip() == "<>"):
+        return BOUNCE
+
+    auto_submitted = (headers.get("Auto-Submitted", "") or "").strip().lower()
+    precedence = (headers.get("Precedence", "") or "").strip().lower()
+    subject = header_text(headers.get("Subject"))
+    if ((auto_submitted and auto_submitted != "no")
+            or headers.get("X-Autoreply") or headers.get("X-Autorespond")
+            or precedence in ("bulk", "junk", "list", "auto_reply")
+            or _AUTO_SUBJECTS.match(subject)):
+        return AUTO_REPLY
+
+    if _FORWARD_SUBJECTS.match(subject):
+        return FORWARDED
+    return GENUINE
+
+# ---------------------------- BODY ----------------------------
+
+def _decode_part(part):
+    payload = part.get_payload(decode=True) or b""
+    for charset in (part.get_content_charset(), "utf-8", "cp1252"):
+        if not charset:
+            continue
+        try:
+            return payload.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return payload.decode("latin-1")
+
+
+def decode_body(msg):
+    """Plain-text body of `msg`, falling back to tag-stripped HTML; never raises on bad charsets."""
+    html = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            return _decode_part(part)
+        if content_type == "text/html" and html is None:
+            html = part
+    return _TAGS.sub("", _decode_part(html)) if html is not None else ""
+
+# ---------------------------- IMAP ----------------------------
+
+def _fetch(imap, uids, query):
+    status, data = imap.uid("fetch", b",".join(uids), query)
+    if status != "OK":
+        return {}
+    fetched = {}
+    for item in data:
+        if isinstance(item, tuple):
+            match = _UID.search(item[0])
+            if match:
+                fetched[match.group(1)] = item[1]
+    return fetched
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _field_matches(value, condition):
+    values = _as_list(value)
+    if isinstance(condition, dict):
+        if set(condition) == {"$in"}:
+            return any(v in condition["$in"] for v in values)
+        if set(condition) == {"$ne"}:
+            return condition["$ne"] not in values
+        raise ValueError(f"Unsupported match condition: {condition}")
+    return condition in values
+
+
+def _matches(doc, match):
+    """`match` (equality, $in, $ne) applied in Python to a document already fetched."""
+    return all(_field_matches(doc.get(field), condition) for field, condition in match.items())
+
+
+def _lookup(collection, match, field, values, known=None):
+    """value -> matching case, in one query.
+
+    With a filter (`known`), the query is unscoped and `match` is applied here, so values no
+    document holds at all can be counted as false positives without a second round trip.
+    """
+    cases = {}
+    if known is None:
+        for case in collection.find({**match, field: {"$in": list(values)}}):
+            for value in _as_list(case.get(field)):
+                cases.setdefault(value, case)
+        return cases
+    found = set()
+    for case in collection.find({field: {"$in": list(values)}}):
+        held = _as_list(case.get(field))
+        found.update(held)
+        if _matches(case, match):
+            for value in held:
+                cases.setdefault(value, case)
+    known.record_false_positive(len(values - found))
+    return cases
+
+
+def _find_cases(collection, match, candidates, cache=None):
+    """One query per batch: thread headers first, sender address as fallback."""
+    refs = {ref for c in candidates for ref in c["refs"]}
+    if cache is not None:
+        refs = {ref for ref in refs if cache.outbound_ids.might_contain(ref)}
+    by_ref = _lookup(collection, match, "outbound_message_ids", refs,
+                     cache.outbound_ids if cache is not None else None) if refs else {}
+    for c in candidates:
+        c["case"] = next((by_ref[r] for r in c["refs"] if r in by_ref), None)
+
+    senders = {c["sender"] for c in candidates if not c["case"] and c["sender"]}
+    if cache is not None:
+        senders = {sender for sender in senders if cache.emails.might_contain(sender)}
+    if senders:
+        by_sender = _lookup(collection, match, "email", senders, cache.emails if cache is not None else None)
+        for c in candidates:
+            c["case"] = c["case"] or by_sender.get(c["sender"])
+    return candidates
+
+
+# ---------------------------- CURSORS ----------------------------
+
+def cursor_key(imap_host, mailbox, stations):
+    """One high-water mark per inbox and station set, so pinned workers keep separate marks."""
+    return f"{imap_host}/{(mailbox or '').lower()}/{','.join(sorted(stations))}"
+
+
+def _uidvalidity(imap):
+    status, data = imap.status("INBOX", "(UIDVALIDITY)")
+    match = _UIDVALIDITY.search(data[0]) if status == "OK" and data else None
+    return int(match.group(1)) if match else None
+
+
+def _load_cursor(cursors, key, uidvalidity):
+    doc = cursors.find_one({"_id": key})
+    # A new UIDVALIDITY means the server renumbered the mailbox; start over
+    if doc is None or uidvalidity is None or doc.get("uidvalidity") != uidvalidity:
+        return 0
+    return doc["last_uid"]
+
+# ---------------------------- INBOX ----------------------------
+
+def process_inbox(imap, collection, match, batch_size=REPLY_BATCH_SIZE, log=print, cache=None, cursor=None):
+    """Classify UNSEEN mail, record genuine replies on their cases and return per-class counts.
+
+    Only mail this pass dealt with (triaged by headers, or recorded on a case) is marked seen;
+    unmatched replies stay unseen for whichever station's pass owns them. With a `cursor`
+    (see cursor_key) the highest UID examined is kept in the reply_cursors collection, so
+    later passes never re-fetch mail that was already looked at and left unseen.
+
+    With a membership.MembershipCache, senders and thread references it has never seen skip the
+    case lookup entirely.
+    """
+    counts = {GENUINE: 0, AUTO_REPLY: 0, BOUNCE: 0, FORWARDED: 0, "unmatched": 0}
+    cursors = collection.database["reply_cursors"]
+    uidvalidity = _uidvalidity(imap) if cursor else None
+    last_uid = _load_cursor(cursors, cursor, uidvalidity) if cursor else 0
+    status, data = imap.uid("search", None, "UID", f"{last_uid + 1}:*", "UNSEEN")
+    if status != "OK":
+        return None
+    # "n:*" always includes the newest message, even when it is below n
+    uids = [uid for uid in data[0].split() if int(uid) > last_uid]
+
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        candidates, seen = [], []
+        for uid, raw in _fetch(imap, batch, "(BODY.PEEK[HEADER])").items():
+            headers = email.message_from_bytes(raw)
+            kind = classify(headers)
+            sender = parseaddr(headers.get("From", ""))[1]
+            if kind != GENUINE:
+                # Classification is the same for every station, so this mail is done with
+                seen.append(uid)
+                counts[kind] += 1
+                log(f"↩ Skipping {kind} from {sender}")
+                continue
+            candidates.append({"uid": uid, "sender": sender, "refs": referenced_ids(headers)})
+
+        matched = [c for c in _find_cases(collection, match, candidates, cache) if c["case"]]
+        counts["unmatched"] += len(candidates) - len(matched)
+        bodies = _fetch(imap, [c["uid"] for c in matched], "(BODY.PEEK[])") if matched else {}
+        for c in matched:
+            raw = bodies.get(c["uid"])
+            if raw is None:
+                continue
+            body = decode_body(email.message_from_bytes(raw))
+            collection.update_one(
+                {"_id": c["case"]["_id"]},
+                {"$set": {
+                    "status": "responded",
+                    "responded_at": datetime.utcnow(),
+                    "reply_content": body.strip()[:1000],
+                    "responded": True
+                }}
+            )
+            seen.append(c["uid"])
+            counts[GENUINE] += 1
+            log(f"✅ Reply recorded from {c['sender']}")
+
+        if seen:
+            imap.uid("store", b",".join(seen), "+FLAGS", "(\\Seen)")
+        if cursor and uidvalidity is not None:
+            cursors.update_one({"_id": cursor},
+                               {"$set": {"uidvalidity": uidvalidity, "last_uid": int(batch[-1])}}, upsert=True)
+    return counts
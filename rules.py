@@ -0,0 +1,326 @@
+# rules.py (versioned keyword rule store with a compiled-matcher cache and hot reload)
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# When set, rules come from this JSON file instead of MongoDB
+RULES_FILE = os.getenv("RULES_FILE")
+
+# How often running workers look for a new active rule set
+RULES_POLL_SECONDS = float(os.getenv("RULES_POLL_SECONDS", "30"))
+
+# Compiled matchers kept per rule-set version
+MATCHER_CACHE_SIZE = 8
+
+# Rule set used until one is saved (the original hardcoded keyword list)
+DEFAULT_RULES = [
+    {"id": "betting", "kind": "keyword", "pattern": "betting", "category": "gambling"},
+    {"id": "crypto", "kind": "keyword", "pattern": "crypto", "category": "financial"},
+    {"id": "money laundering", "kind": "phrase", "pattern": "money laundering", "category": "financial"},
+    {"id": "nude", "kind": "keyword", "pattern": "nude", "category": "sexual"},
+    {"id": "drug", "kind": "keyword", "pattern": "drug", "category": "narcotics"},
+    {"id": "blackmail", "kind": "keyword", "pattern": "blackmail", "category": "extortion"},
+    {"id": "dark web", "kind": "phrase", "pattern": "dark web", "category": "dark_web"},
+    {"id": "bitcoin", "kind": "keyword", "pattern": "bitcoin", "category": "financial"},
+    {"id": "casino", "kind": "keyword", "pattern": "casino", "category": "gambling"},
+    {"id": "win money", "kind": "phrase", "pattern": "win money", "category": "gambling"},
+    {"id": "10x returns", "kind": "phrase", "pattern": "10x returns", "category": "financial"},
+    {"id": "double your money", "kind": "phrase", "pattern": "double your money", "category": "financial"},
+]
+
+# ---------------------------- RULES ----------------------------
+
+# Group references would be renumbered (or clash) once rules are joined into one alternation
+_GROUP_REFS = re.compile(r"\\(.)|\(\?P[<=]|\(\?\(")
+
+# Fields that decide what text a rule matches; editing any of them can change any flag
+_MATCH_FIELDS = ("kind", "pattern", "enabled")
+
+
+def _check_pattern(rule):
+    """Compile the rule the way Matcher will, so a bad rule is rejected before it is saved."""
+    if rule["kind"] == "regex":
+        for m in _GROUP_REFS.finditer(rule["pattern"]):
+            if m.group(1) is None or m.group(1) in "123456789g":
+                raise ValueError(f"Rule {rule['id']!r}: backreferences and named groups are not supported")
+    try:
+        compiled = re.compile(f"(?:{_rule_regex(rule)})", re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"Rule {rule['id']!r}: invalid pattern: {e}")
+    if compiled.match(""):
+        raise ValueError(f"Rule {rule['id']!r}: pattern matches empty text")
+
+
+def normalize_rule(rule):
+    """Validated, canonical copy of `rule`; every problem is a ValueError (POST /rules -> 400)."""
+    if not isinstance(rule, dict):
+        raise ValueError(f"Rule must be an object: {rule!r}")
+    kind = rule.get("kind", "keyword")
+    if kind not in ("keyword", "phrase", "regex"):
+        raise ValueError(f"Unknown rule kind: {kind}")
+    if not isinstance(rule.get("pattern"), str) or not rule["pattern"].strip():
+        raise ValueError(f"Rule pattern must be a non-empty string: {rule.get('pattern')!r}")
+    rule_id = rule.get("id") or rule["pattern"]
+    if not isinstance(rule_id, (str, int)) or isinstance(rule_id, bool):
+        raise ValueError(f"Rule id must be a string: {rule_id!r}")
+    weight = rule.get("weight", 1)
+    # bool is an int subclass; "weight": true is a mistake, not 1.0
+    if not isinstance(weight, (int, float)) or isinstance(weight, bool) or not math.isfinite(weight):
+        raise ValueError(f"Rule {rule_id!r}: weight must be a number, got {weight!r}")
+    enabled = rule.get("enabled", True)
+    # bool("false") is True, so only real booleans are accepted
+    if not isinstance(enabled, bool):
+        raise ValueError(f"Rule {rule_id!r}: enabled must be true or false, got {enabled!r}")
+    category = rule.get("category", "other")
+    if not isinstance(category, str):
+        raise ValueError(f"Rule {rule_id!r}: category must be a string, got {category!r}")
+    rule = {
+        "id": str(rule_id),
+        "kind": kind,
+        "pattern": rule["pattern"],
+        "weight": float(weight),
+        "enabled": enabled,
+        "category": category,
+    }
+    _check_pattern(rule)
+    return rule
+
+
+def rule_set_version(rules):
+    """Content hash of the rule set, so identical rules always share a version."""
+    canonical = json.dumps(sorted(rules, key=lambda r: r["id"]), sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def _rule_regex(rule):
+    if rule["kind"] == "regex":
+        return rule["pattern"]
+    if rule["kind"] == "phrase":
+        return r"\s+".join(re.escape(word) for word in rule["pattern"].split())
+    return re.escape(rule["pattern"])
+
+# ---------------------------- MATCHER ----------------------------
+
+class Scan:
+    __slots__ = ("score", "matched", "rule_version")
+
+    def __init__(self, score, matched, rule_version):
+        self.score = score
+        self.matched = matched
+        self.rule_version = rule_version
+
+    def as_fields(self):
+        """Fields stored on a flagged message."""
+        return {
+            "suspicion_score": self.score,
+            "matched_keywords": self.matched,
+            "rule_version": self.rule_version,
+        }
+
+
+class Matcher:
+    """All enabled rules compiled into one alternation; `lastgroup` tells which rule fired."""
+
+    def __init__(self, version, rules):
+        self.version = version
+        self.rules = rules
+        enabled = [r for r in rules if r["enabled"]]
+        self._by_group = {f"r{i}": r for i, r in enumerate(enabled)}
+        self.categories = {r["id"]: r["category"] for r in rules}
+        if enabled:
+            self.pattern = re.compile(
+                "|".join(f"(?P<{g}>{_rule_regex(r)})" for g, r in self._by_group.items()),
+                re.IGNORECASE,
+            )
+        else:
+            self.pattern = None
+
+    def scan(self, text):
+        matched, score = [], 0.0
+        if self.pattern is not None:
+            for m in self.pattern.finditer(text):
+                rule = self._by_group[m.lastgroup]
+                matched.append(rule["id"])
+                score += rule["weight"]
+        return Scan(int(score) if score.is_integer() else round(score, 3), matched, self.version)
+
+
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+def compiled_matcher(version, rules):
+    """Compile a rule set once per version; later lookups of the same version are free."""
+    with _matchers_lock:
+        matcher = _matchers.get(version)
+        if matcher is None:
+            matcher = Matcher(version, rules)
+            _matchers[version] = matcher
+            if len(_matchers) > MATCHER_CACHE_SIZE:
+                _matchers.popitem(last=False)
+        else:
+            _matchers.move_to_end(version)
+        return matcher
+
+# ---------------------------- STORE ----------------------------
+
+class RuleStore:
+    """Serves the active Matcher and swaps in a new one when the rule set changes.
+
+    Callers take `store.current()` once per batch and scan with that object, so a swap
+    never affects a scan already in flight.
+    """
+
+    def __init__(self, db=None, path=RULES_FILE, poll_seconds=RULES_POLL_SECONDS):
+        self.db = db
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self._matcher = None
+        self._source_stamp = None
+        self._checked_at = 0.0
+        self._file_history = {}
+        self._lock = threading.Lock()
+
+    def current(self):
+        if self._matcher is None or time.monotonic() - self._checked_at >= self.poll_seconds:
+            self.reload()
+        return self._matcher
+
+    def reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stamp = self._stamp()
+                if self._matcher is not None and stamp == self._source_stamp:
+                    return self._matcher
+                version, rules = self._load()
+                self._matcher = compiled_matcher(version, rules)
+                self._source_stamp = stamp
+            except (OSError, KeyError, TypeError, ValueError, re.error) as e:
+                # A rules file that is missing mid-save or invalid (or a set stored before validation)
+                # must not take workers down; the next poll tries again
+                if self._matcher is None:
+                    raise
+                print(f"❌ Keeping rule version {self._matcher.version}: {e}")
+            return self._matcher
+
+    def _stamp(self):
+        # Cheap change check: file mtime, or the active-version pointer document
+        if self.path:
+            return os.stat(self.path).st_mtime_ns
+        meta = self.db["rule_meta"].find_one({"_id": "active"})
+        return meta["version"] if meta else None
+
+    def _load(self):
+        if self.path:
+            with open(self.path) as f:
+                data = json.load(f)
+            rules = [normalize_rule(r) for r in (data["rules"] if isinstance(data, dict) else data)]
+            version = rule_set_version(rules)
+            self._file_history[version] = rules
+            return version, rules
+        meta = self.db["rule_meta"].find_one({"_id": "active"})
+        if meta is None:
+            return save_rules(self.db, DEFAULT_RULES)
+        rule_set = self.db["rule_sets"].find_one({"_id": meta["version"]})
+        return rule_set["_id"], rule_set["rules"]
+
+    def rules_for(self, version):
+        """Rules of an older version, for working out what a change affects."""
+        if self.path:
+            return self._file_history.get(version)
+        rule_set = self.db["rule_sets"].find_one({"_id": version})
+        return rule_set["rules"] if rule_set else None
+
+
+def save_rules(db, rules):
+    """Store an immutable rule set and make it the active one; workers pick it up on their next poll."""
+    rules = [normalize_rule(r) for r in rules]
+    version = rule_set_version(rules)
+    db["rule_sets"].update_one(
+        {"_id": version},
+        {"$setOnInsert": {"rules": rules, "created_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    db["rule_meta"].update_one(
+        {"_id": "active"},
+        {"$set": {"version": version, "activated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    return version, rules
+
+# ---------------------------- RE-SCAN ----------------------------
+
+def _rule_changes(old_rules, new_rules):
+    """Rule ids edited or removed, and whether every flag of the old version needs a rescan.
+
+    A new enabled rule, or an edit to what a rule matches, can catch flags that matched
+    nothing before, so only weight/category edits and removals take the targeted path.
+    """
+    old = {r["id"]: r for r in old_rules}
+    new = {r["id"]: r for r in new_rules}
+    changed = {i for i in old if i not in new or old[i] != new[i]}
+    full = False
+    for i, rule in new.items():
+        if i not in old:
+            full |= rule["enabled"]
+        elif old[i]["enabled"] or rule["enabled"]:
+            full |= any(old[i][field] != rule[field] for field in _MATCH_FIELDS)
+    return changed, full
+
+
+def rescan_flags(collection, store, threshold=1, log=print):
+    """Bring flags produced by older rule sets up to the active one, touching only what changed.
+
+    When only weights, categories or removals differ, flags that matched none of those rules keep
+    their score and just get the new version stamped; any other change rescans the whole version. Unflagged source messages a new rule might catch
+    are picked up by the next flag_suspicious_users.py run.
+    """
+    matcher = store.current()
+    collection.create_index("rule_version")
+    counts = {"restamped": 0, "rescanned": 0, "cleared": 0}
+    versions = collection.distinct("rule_version", {"rule_version": {"$ne": matcher.version}})
+    # None also selects flags stored before rule versions were recorded
+    for version in [v for v in versions if v is not None] + [None]:
+        old_rules = store.rules_for(version) if version else None
+        if old_rules is None:
+            changed, full = None, True
+        else:
+            changed, full = _rule_changes(old_rules, matcher.rules)
+
+        query = {"rule_version": version}
+        if not full:
+            unaffected = {**query, "matched_keywords": {"$nin": list(changed)}}
+            counts["restamped"] += collection.update_many(
+                unaffected, {"$set": {"rule_version": matcher.version}}).modified_count
+            query["matched_keywords"] = {"$in": list(changed)}
+
+        for doc in collection.find(query, {"text": 1, "status": 1}):
+            scan = matcher.scan(str(doc.get("text", "")))
+            update = scan.as_fields()
+            if scan.score < threshold and doc.get("status") == "warning_pending":
+                update["status"] = "cleared"
+                counts["cleared"] += 1
+            collection.update_one({"_id": doc["_id"]}, {"$set": update})
+            counts["rescanned"] += 1
+        log(f"🔁 Rule version {version} -> {matcher.version}: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    db = client[os.getenv("MONGO_DB", "crpcdb")]
+    print(rescan_flags(db["flagged_messages"], RuleStore(db)))
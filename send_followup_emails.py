@@ -1,9 +1,9 @@
 from pymongo import MongoClient
-from email.message import EmailMessage
-import smtplib
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timedelta
+from mailer import body_template, build_message, send_message, smtp_session
+from stations import ensure_station_indexes, worker_stations
 
 # Load credentials
 load_dotenv()
@@ -15,66 +15,77 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 client = MongoClient(MONGO_URI)
 db = client["social_monitoring"]
 collection = db["flagged_messages"]
+ensure_station_indexes(collection)
 
-# Time check: 48 hours ago
-now = datetime.utcnow()
-threshold = now - timedelta(hours=48)
-
-# Fetch users who were warned 48+ hours ago and haven't replied
-pending = collection.find({
-    "status": "warning_sent",
-    "warning_sent_at": {"$lte": threshold},
-    "responded": {"$ne": True}
-})
-
-count = 0
-for user in pending:
-    email = user.get("email")
-    username = user.get("username", "User")
-    flagged_text = user.get("text", "")
-
-    if not email:
-        print(f"⚠ Skipping user {username} — no email.")
-        continue
-
-    subject = "⏰ Final Warning: Suspicious Activity"
-    body = f"""Dear {username},
+# Email template (compiled once, rendered per user)
+FOLLOWUP_SUBJECT = "⏰ Final Warning: Suspicious Activity"
+FOLLOWUP_BODY = body_template("""Dear {{ username }},
 
 You were previously notified about suspicious content:
 ---
-"{flagged_text}"
+"{{ text }}"
 ---
 
 This is a final warning. If you do not respond within 24 hours, legal action under Section 91 CrPC may be initiated.
 
-Regards,  
+Regards,
 Cyber Monitoring Unit
-"""
+""")
 
-    try:
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = EMAIL
-        msg["To"] = email
-        msg.set_content(body)
-
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(EMAIL, PASSWORD)
-            smtp.send_message(msg)
-
-        # Update DB
-        collection.update_one(
-            {"_id": user["_id"]},
-            {"$set": {
-                "status": "followup_sent",
-                "followup_sent_at": datetime.utcnow()
-            }}
-        )
-
-        print(f"📨 Follow-up sent to {email}")
-        count += 1
+# Time check: 48 hours ago
+now = datetime.utcnow()
+threshold = now - timedelta(hours=48)
 
+count = 0
+for station in worker_stations(db):
+    # Fetch this station's users who were warned 48+ hours ago and haven't replied
+    pending = list(collection.find({
+        "station": station.key,
+        "status": "warning_sent",
+        "warning_sent_at": {"$lte": threshold},
+        "responded": {"$ne": True}
+    }))
+
+    # Log in only when this station has work; a station that cannot log in is reported and skipped
+    if not pending:
+        continue
+    try:
+        with smtp_session(station["sender_email"], station.sender_password) as smtp:
+            for user in pending:
+                email = user.get("email")
+                username = user.get("username", "User")
+                flagged_text = user.get("text", "")
+
+                if not email:
+                    print(f"⚠ Skipping user {username} — no email.")
+                    continue
+
+                # Thread the follow-up under the original warning so replies correlate
+                thread = {}
+                if user.get("warning_message_id"):
+                    thread = {"In-Reply-To": user["warning_message_id"], "References": user["warning_message_id"]}
+                msg = build_message(email, FOLLOWUP_SUBJECT, FOLLOWUP_BODY.render(username=username, text=flagged_text),
+                                    sender=station["sender_email"], extra_headers=thread)
+
+                try:
+                    send_message(smtp, msg)
+
+                    # Update DB
+                    collection.update_one(
+                        {"_id": user["_id"]},
+                        {"$set": {
+                            "status": "followup_sent",
+                            "followup_sent_at": datetime.utcnow()
+                        },
+                         "$addToSet": {"outbound_message_ids": msg.message_id}}
+                    )
+
+                    print(f"📨 [{station.key}] Follow-up sent to {email}")
+                    count += 1
+
+                except Exception as e:
+                    print(f"❌ Failed to send follow-up to {email}: {e}")
     except Exception as e:
-        print(f"❌ Failed to send follow-up to {email}: {e}")
+        print(f"❌ [{station.key}] Skipped: {e}")
 
 print(f"\n📤 Total follow-ups sent: {count}")
\ No newline at end of file
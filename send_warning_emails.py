@@ -1,9 +1,9 @@
 from pymongo import MongoClient
-from email.message import EmailMessage
-import smtplib
 from dotenv import load_dotenv
 import os
 from datetime import datetime
+from mailer import body_template, build_message, send_message, smtp_session
+from stations import ensure_station_indexes, worker_stations
 
 # Load credentials from .env
 load_dotenv()
@@ -18,27 +18,15 @@ if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
 client = MongoClient("mongodb://localhost:27017")
 db = client["social_monitoring"]
 collection = db["flagged_messages"]
+ensure_station_indexes(collection)
 
-# Fetch users with pending warnings
-pending = collection.find({"status": "warning_pending"})
-
-count = 0
-for user in pending:
-    email = user.get("email")
-    username = user.get("username", "User")
-    flagged_text = user.get("text", "")
-
-    if not email:
-        print(f"⚠ Skipping user {username} — no email.")
-        continue
-
-    # Prepare the email
-    subject = "⚠ Suspicious Activity Detected"
-    body = f"""Dear {username},
+# Email template (compiled once, rendered per user)
+WARNING_SUBJECT = "⚠ Suspicious Activity Detected"
+WARNING_BODY = body_template("""Dear {{ username }},
 
 We've detected suspicious content linked to your recent activity:
 ---
-"{flagged_text}"
+"{{ text }}"
 ---
 
 This violates our usage policies. Please refrain from such content.
@@ -46,32 +34,54 @@ If this was a mistake, please reply within 48 hours.
 
 Regards,
 Cyber Monitoring Unit
-"""
+""")
 
-    try:
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = EMAIL_ADDRESS
-        msg["To"] = email
-        msg.set_content(body)
-
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.send_message(msg)
-
-        # Mark warning sent in DB
-        collection.update_one(
-            {"_id": user["_id"]},
-            {"$set": {
-                "status": "warning_sent",
-                "warning_sent_at": datetime.utcnow()
-            }}
-        )
-
-        print(f"✅ Warning email sent to {email}")
-        count += 1
+count = 0
+for station in worker_stations(db):
+    subject = station["warning_subject"] or WARNING_SUBJECT
+    template = body_template(station["warning_body"]) if station["warning_body"] else WARNING_BODY
+
+    # Fetch this station's users with pending warnings
+    pending = list(collection.find({"station": station.key, "status": "warning_pending"}))
 
+    # Log in only when this station has work; a station that cannot log in is reported and skipped
+    if not pending:
+        continue
+    try:
+        with smtp_session(station["sender_email"], station.sender_password) as smtp:
+            for user in pending:
+                email = user.get("email")
+                username = user.get("username", "User")
+                flagged_text = user.get("text", "")
+
+                if not email:
+                    print(f"⚠ Skipping user {username} — no email.")
+                    continue
+
+                # Prepare the email
+                msg = build_message(email, subject, template.render(username=username, text=flagged_text, station=station),
+                                    sender=station["sender_email"])
+
+                try:
+                    send_message(smtp, msg)
+
+                    # Mark warning sent in DB
+                    collection.update_one(
+                        {"_id": user["_id"]},
+                        {"$set": {
+                            "status": "warning_sent",
+                            "warning_sent_at": datetime.utcnow(),
+                            "warning_message_id": msg.message_id
+                        },
+                         "$addToSet": {"outbound_message_ids": msg.message_id}}
+                    )
+
+                    print(f"✅ [{station.key}] Warning email sent to {email}")
+                    count += 1
+
+                except Exception as e:
+                    print(f"❌ Failed to send to {email}: {e}")
     except Exception as e:
-        print(f"❌ Failed to send to {email}: {e}")
+        print(f"❌ [{station.key}] Skipped: {e}")
 
 print(f"\n📤 Total warnings sent: {count}")
\ No newline at end of file
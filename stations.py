@@ -0,0 +1,114 @@
+# stations.py (per-station tenancy: profiles, worker pinning and scoped indexes)
+
+import os
+from dotenv import load_dotenv
+from pymongo import ASCENDING
+
+# Load environment variables
+load_dotenv()
+
+# Documents written before stations existed belong to this one
+DEFAULT_STATION = os.getenv("DEFAULT_STATION", "hyd-hq")
+
+# Station profiles live in this one database for the API and every script
+STATIONS_DB = os.getenv("STATIONS_DB", "crpcdb")
+
+# Comma-separated station keys this worker owns; empty means every station
+WORKER_STATIONS = [s.strip() for s in os.getenv("WORKER_STATIONS", "").split(",") if s.strip()]
+
+# Issuing office and mailbox used when a station document leaves a field out
+DEFAULT_PROFILE = {
+    "officer_name": "Inspector General",
+    "designation": "Cyber Cell",
+    "police_station": "Hyderabad HQ",
+    "contact_info": "cybercell@hyderabadpolice.gov.in",
+    "sender_email": os.getenv("EMAIL_ADDRESS"),
+    "password_env": "EMAIL_PASSWORD",
+    "imap_host": "imap.gmail.com",
+    "warning_subject": None,
+    "warning_body": None,
+}
+
+# ---------------------------- PROFILES ----------------------------
+
+class Station(dict):
+    """A station document merged over DEFAULT_PROFILE; `key` is the partition value."""
+
+    @property
+    def key(self):
+        return self["_id"]
+
+    @classmethod
+    def from_document(cls, doc):
+        profile = {**DEFAULT_PROFILE, **doc}
+        # The default password only ever unlocks the default mailbox
+        if "password_env" not in doc and profile["sender_email"] != DEFAULT_PROFILE["sender_email"]:
+            profile["password_env"] = None
+        return cls(profile)
+
+    @property
+    def sender_password(self):
+        """Password for this station's SMTP and IMAP logins; raises rather than borrow another one."""
+        # Secrets stay in the environment; the station document only names the variable
+        if not self["password_env"]:
+            raise RuntimeError(f"Station {self.key} has its own mailbox {self['sender_email']} but no password_env")
+        password = os.getenv(self["password_env"])
+        if not password:
+            raise RuntimeError(f"Station {self.key}: {self['password_env']} is not set")
+        return password
+
+
+def _stations_collection(db):
+    # Callers pass whichever database they work in; profiles are shared across all of them
+    return db.client[STATIONS_DB]["stations"]
+
+
+def load_stations(db):
+    stations = {DEFAULT_STATION: Station.from_document({"_id": DEFAULT_STATION})}
+    for doc in _stations_collection(db).find():
+        stations[doc["_id"]] = Station.from_document(doc)
+    return stations
+
+
+def get_station(db, key):
+    key = key or DEFAULT_STATION
+    doc = _stations_collection(db).find_one({"_id": key})
+    if doc is None and key != DEFAULT_STATION:
+        return None
+    return Station.from_document({**(doc or {}), "_id": key})
+
+
+def worker_stations(db, requested=None):
+    """Stations this process should tick: `requested` if given, else its pinned set, else all."""
+    stations = load_stations(db)
+    keys = [requested] if requested else (WORKER_STATIONS or list(stations))
+    return [stations[k] for k in keys if k in stations]
+
+
+def mailbox_groups(stations):
+    """(station, keys) per distinct inbox; stations without their own mailbox share the default one.
+
+    Reply processing must read each inbox once for all of its stations, or one station's pass
+    would consume (mark seen) replies that belong to another.
+    """
+    groups = {}
+    for st in stations:
+        mailbox = (st["imap_host"], (st["sender_email"] or "").lower())
+        groups.setdefault(mailbox, (st, []))[1].append(st.key)
+    return list(groups.values())
+
+# ---------------------------- INDEXES ----------------------------
+
+def ensure_station_indexes(flagged_collection=None, crpc_collection=None):
+    """Station-leading indexes so each lifecycle tick only touches its own partition."""
+    if flagged_collection is not None:
+        flagged_collection.update_many({"station": {"$exists": False}}, {"$set": {"station": DEFAULT_STATION}})
+        flagged_collection.create_index([("station", ASCENDING), ("status", ASCENDING), ("warning_sent_at", ASCENDING)])
+        flagged_collection.create_index([("station", ASCENDING), ("outbound_message_ids", ASCENDING)])
+        flagged_collection.create_index([("station", ASCENDING), ("email", ASCENDING)])
+        # Unscoped lookups: membership refreshes (lifecycle fields) and reply false-positive checks
+        for field in ("flagged_at", "warning_sent_at", "followup_sent_at", "email", "outbound_message_ids"):
+            flagged_collection.create_index([(field, ASCENDING)])
+    if crpc_collection is not None:
+        crpc_collection.update_many({"station": {"$exists": False}}, {"$set": {"station": DEFAULT_STATION}})
+        crpc_collection.create_index([("station", ASCENDING), ("status", ASCENDING), ("sent_at", ASCENDING)])